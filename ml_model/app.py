@@ -1,13 +1,15 @@
-from flask import Flask, request, jsonify
-from werkzeug.utils import secure_filename
+from flask import Flask, request, jsonify, g
 import os
 import base64
 import sys
 from pathlib import Path
 from flask_cors import CORS
+from werkzeug.exceptions import BadRequest
 import logging
 import time
 import stat
+import tempfile
+import hashlib
 
 # Configure logging
 logging.basicConfig(
@@ -18,24 +20,58 @@ logger = logging.getLogger(__name__)
 
 # Add the parent directory to Python path
 sys.path.append(str(Path(__file__).parent.parent))
-from ml_model.detect import detect_wellpads, load_model
+# Before TensorFlow, see the SQLite note of ml_model.store
+from ml_model.store import DetectionStore, from_detections, from_geojson
+from ml_model.detect import decode_image, detect_wellpads, predict_batch, registry
+from ml_model.batching import MicroBatcher
+from ml_model.encoding import build_multipart
+from ml_model.cache import ResultCache
+from ml_model.jobs import JobManager, QueueFullError, ClientError
+from ml_model.metrics import (metrics, stage, SampledProfiler, HTTP_REQUEST_SECONDS, HTTP_REQUEST_BYTES,
+                              HTTP_RESPONSE_BYTES)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 # Configure environment variables with defaults
-UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', str(Path(__file__).parent / 'uploads'))
 MODEL_PATH = os.getenv('MODEL_PATH', str(Path(__file__).parent / 'results' / '2025-04-09_wellpad_model_.keras'))
 FLASK_ENV = os.getenv('FLASK_ENV', 'development')
+TILED_INFERENCE = os.getenv('TILED_INFERENCE', 'false').lower() in ('1', 'true', 'yes')
+TILE_OVERLAP = int(os.getenv('TILE_OVERLAP', '32'))
+TILE_BATCH_SIZE = int(os.getenv('TILE_BATCH_SIZE', '8'))
+# Tiled inference first screens a downsampled scene and skips the windows without wellpads
+SCREEN_SCALE = float(os.getenv('SCREEN_SCALE', '0'))
+SCREEN_THRESHOLD = float(os.getenv('SCREEN_THRESHOLD', '0.1'))
+# Test-time augmentation averages the eight flips and rotations, clients can override it per request
+TEST_TIME_AUGMENTATION = os.getenv('TEST_TIME_AUGMENTATION', 'false').lower() in ('1', 'true', 'yes')
+MICRO_BATCHING = os.getenv('MICRO_BATCHING', 'true').lower() in ('1', 'true', 'yes')
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '10'))
+MIN_WELLPAD_AREA = int(os.getenv('MIN_WELLPAD_AREA', '0'))
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_MEMORY_MB = int(os.getenv('RESULT_CACHE_MEMORY_MB', '256'))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', '')
+RESULT_CACHE_DISK_MB = int(os.getenv('RESULT_CACHE_DISK_MB', '1024'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '8'))
+JOB_STORE_DIR = os.getenv('JOB_STORE_DIR', '')
+JOB_TTL_SECONDS = int(os.getenv('JOB_TTL_SECONDS', '3600'))
+JOB_RETRY_AFTER = int(os.getenv('JOB_RETRY_AFTER', '5'))
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Directory shared by the worker processes, /metrics then serves the sum over all workers
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(Path(tempfile.gettempdir()) / 'dopa-profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))
+# SQLite file of the detection store, empty disables /api/detections
+DETECTION_STORE_PATH = os.getenv('DETECTION_STORE_PATH', '')
+DETECTION_QUERY_MAX_LIMIT = int(os.getenv('DETECTION_QUERY_MAX_LIMIT', '1000'))
+# Disabled by the gunicorn config when the app is preloaded in the master process
+LOAD_MODEL_ON_IMPORT = os.getenv('LOAD_MODEL_ON_IMPORT', 'true').lower() in ('1', 'true', 'yes')
 
-# Initialize directories
-def initialize_directories():
+# Uploads are decoded in memory and never written to disk, only the model file is needed
+def check_model_file():
     try:
-        # Create upload directory if it doesn't exist
-        upload_path = Path(UPLOAD_FOLDER)
-        upload_path.mkdir(parents=True, exist_ok=True)
-        logger.info(f"Upload directory {upload_path} created or exists")
-        
         # Verify model file exists and is readable
         model_path = Path(MODEL_PATH)
         if not model_path.exists():
@@ -60,103 +96,432 @@ def initialize_directories():
         logger.error(f"Initialization failed: {e}")
         return False
 
-# Initialize on startup
-if not initialize_directories():
-    logger.error("Failed to initialize directories")
+# Check on startup
+if not check_model_file():
+    logger.error("Failed to find the model file")
     sys.exit(1)
 
 app.config.update(
-    UPLOAD_FOLDER=str(UPLOAD_FOLDER),
     MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB max file size
     MODEL_PATH=str(MODEL_PATH)
 )
 
+# Load the model once for this process, health checks only read the cached state
+if LOAD_MODEL_ON_IMPORT:
+    try:
+        registry.preload()
+    except Exception as e:
+        logger.error(f"Failed to load model during startup: {e}")
+
+# Predictions of concurrent requests are merged into shared forward passes
+batcher = MicroBatcher(predict_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS) if MICRO_BATCHING else None
+
+# Per-stage latency and size histograms, served by /metrics
+metrics.enabled = METRICS_ENABLED
+if METRICS_ENABLED and METRICS_DIR:
+    metrics.share(METRICS_DIR)
+# A fraction of the detections can be run under cProfile, the profiles are written to PROFILE_DIR
+profiler = SampledProfiler(rate=PROFILE_SAMPLE_RATE, output_dir=PROFILE_DIR, max_files=PROFILE_MAX_FILES)
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, str(response.status_code))
+        if request.content_length is not None:
+            HTTP_REQUEST_BYTES.observe(request.content_length, endpoint)
+        # Streamed responses have no length and are not recorded
+        if response.content_length is not None:
+            HTTP_RESPONSE_BYTES.observe(response.content_length, endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Metrics in the Prometheus text format, summed over the workers when METRICS_DIR is set."""
+    return app.response_class(metrics.render(), status=200, mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     start_time = time.time()
+    model_status = registry.status()
     health_status = {
         "status": "healthy",
         "checks": {
-            "upload_directory": False,
-            "model_loading": False,
+            "model_loading": model_status["ready"],
             "environment": FLASK_ENV,
             "model_path": str(MODEL_PATH)
         },
+        "model": model_status,
+        "result_cache": result_cache.stats() if result_cache else None,
         "timestamp": start_time
     }
     
-    try:
-        # Check upload directory
-        upload_path = Path(UPLOAD_FOLDER)
-        if upload_path.exists():
-            health_status["checks"]["upload_directory"] = True
-        else:
-            raise Exception(f"Upload directory not found at {upload_path}")
-        
-        # Check model loading
-        try:
-            model = load_model()
-            if model is not None:
-                health_status["checks"]["model_loading"] = True
-            else:
-                raise Exception("Model loaded but returned None")
-        except Exception as e:
-            logger.error(f"Model loading check failed: {e}")
-            raise Exception(f"Model loading failed: {str(e)}")
-        
-        # Calculate response time
-        health_status["response_time"] = time.time() - start_time
-        return jsonify(health_status), 200
-        
-    except Exception as e:
+    if not model_status["ready"]:
         health_status["status"] = "unhealthy"
-        health_status["error"] = str(e)
-        health_status["response_time"] = time.time() - start_time
-        logger.error(f"Health check failed: {e}")
+        health_status["error"] = model_status["error"] or "Model is not loaded"
+    
+    health_status["response_time"] = time.time() - start_time
+    if health_status["status"] != "healthy":
+        logger.error(f"Health check failed: {health_status['error']}")
         return jsonify(health_status), 500
+    return jsonify(health_status), 200
 
-@app.route('/api/detect', methods=['POST'])
-def detect():
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    alive = registry.is_alive()
+    return jsonify({"alive": alive, "pid": os.getpid()}), 200 if alive else 500
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    ready = registry.is_ready()
+    return jsonify({"ready": ready, "pid": os.getpid()}), 200 if ready else 503
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "batching": batcher.stats() if batcher else None,
+        "result_cache": result_cache.stats() if result_cache else None,
+        "jobs": job_manager.stats()
+    }), 200
+
+# Identical uploads with identical settings are answered from the cache
+result_cache = ResultCache(
+    max_items=RESULT_CACHE_SIZE,
+    max_bytes=RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+    disk_dir=RESULT_CACHE_DIR or None,
+    disk_max_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024
+) if RESULT_CACHE_SIZE > 0 or RESULT_CACHE_DIR else None
+
+# Large scenes are processed in the background by the job API
+job_manager = JobManager(
+    num_workers=JOB_WORKERS,
+    max_queue=JOB_QUEUE_SIZE,
+    store_dir=JOB_STORE_DIR or None,
+    ttl_seconds=JOB_TTL_SECONDS
+)
+
+# Detections of georeferenced uploads are accumulated for bounding box and radius queries
+detection_store = DetectionStore(DETECTION_STORE_PATH) if DETECTION_STORE_PATH else None
+
+# Response formats of /api/detect, chosen with the `format` parameter or the Accept header
+RESPONSE_FORMATS = ('json', 'png', 'multipart', 'rle', 'polygons')
+ACCEPT_FORMATS = {
+    'application/json': 'json',
+    'image/png': 'png',
+    'multipart/mixed': 'multipart'
+}
+
+def request_param(name, default=None):
+    """Read a parameter from the query string or, failing that, the form fields."""
+    return request.args.get(name, request.form.get(name, default))
+
+def negotiate_format():
+    """Pick the response format from the `format` parameter, falling back to the Accept header."""
+    response_format = request_param('format')
+    if response_format is None:
+        best = request.accept_mimetypes.best_match(list(ACCEPT_FORMATS), default='application/json')
+        return ACCEPT_FORMATS[best]
+    response_format = response_format.lower()
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown format '{response_format}', expected one of {list(RESPONSE_FORMATS)}")
+    return response_format
+
+def requested_outputs(response_format):
+    """
+    Results to compute for a response format. Image formats honour `include` (json, multipart)
+    or `image` (png) so clients that only need the mask never pay for the overlay.
+    """
+    if response_format in ('rle', 'polygons'):
+        return (response_format,)
+    if response_format == 'png':
+        image = request_param('image', 'mask')
+        if image not in ('mask', 'overlay'):
+            raise ValueError(f"Unknown image '{image}', expected 'mask' or 'overlay'")
+        return (image,)
+    include = tuple(part.strip() for part in request_param('include', 'mask,overlay').split(',') if part.strip())
+    if not include or set(include) - {'mask', 'overlay'}:
+        raise ValueError(f"include must list 'mask' and/or 'overlay', got '{request_param('include')}'")
+    return include
+
+def build_response(results, response_format):
+    """Serialize detection results in the negotiated format."""
+    metadata = {"shape": results['shape'], "detections": results['detections']}
+    if response_format == 'png':
+        data = results.get('mask', results.get('overlay'))
+        response = app.response_class(data, status=200, mimetype='image/png')
+        response.headers['X-Image-Height'] = str(results['shape'][0])
+        response.headers['X-Image-Width'] = str(results['shape'][1])
+        response.headers['X-Wellpad-Count'] = str(results['detections']['count'])
+        response.headers['X-Coverage-Percent'] = str(results['detections']['coverage_percent'])
+        return response
+    if response_format == 'multipart':
+        parts = [("metadata", 'application/json', metadata)]
+        parts += [(name, 'image/png', results[name]) for name in ('mask', 'overlay') if name in results]
+        with stage('serialize'):
+            body, content_type = build_multipart(parts)
+        return app.response_class(body, status=200, content_type=content_type)
+    if response_format in ('rle', 'polygons'):
+        metadata[response_format] = results[response_format]
+        with stage('serialize'):
+            response = jsonify(metadata)
+        return response, 200
+
+    # Convert results to base64
+    with stage('base64'):
+        for name in ('mask', 'overlay'):
+            if name in results:
+                metadata[name] = base64.b64encode(results[name]).decode('utf-8')
+    with stage('serialize'):
+        response = jsonify(metadata)
+    return response, 200
+
+def parse_numbers(name, count):
+    """A parameter of count comma separated numbers, or None when it is missing."""
+    value = request_param(name)
+    if value is None:
+        return None
+    try:
+        numbers = [float(v) for v in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise ValueError(f"{name} must be {count} comma separated numbers, got '{value}'")
+    return numbers
+
+def parse_detect_request():
+    """
+    Validate an upload and its detection options.
+
+    Returns:
+        tuple: (image bytes, options dict)
+    Raises:
+        BadRequest: The upload or one of the options is invalid.
+    """
     if 'image' not in request.files:
-        return jsonify({"error": "No image file provided"}), 400
+        raise BadRequest("No image file provided")
     
     file = request.files['image']
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+        raise BadRequest("No selected file")
     
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        response_format = negotiate_format()
+        outputs = requested_outputs(response_format)
+        threshold = float(request_param('threshold', '0.5'))
+        if not 0.0 <= threshold <= 1.0:
+            raise ValueError(f"threshold must be between 0 and 1, got {threshold}")
+        # GDAL geotransform of the upload, its detections are added to the detection store
+        transform = parse_numbers('transform', 6)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    
+    # Decode straight from the request buffer, the upload never touches the disk
+    with stage('read_upload'):
+        image_bytes = file.read()
+    logger.info(f"Received {file.filename} ({len(image_bytes)} bytes)")
+    
+    # Tiled inference can be requested per upload, otherwise the server default applies
+    tiled = request_param('tiled', str(TILED_INFERENCE)).lower() in ('1', 'true', 'yes')
+    tta = request_param('tta', str(TEST_TIME_AUGMENTATION)).lower() in ('1', 'true', 'yes')
+    return image_bytes, {
+        "filename": file.filename,
+        "response_format": response_format,
+        "outputs": outputs,
+        "threshold": threshold,
+        "tiled": tiled,
+        "tta": tta,
+        "transform": transform
+    }
+
+def run_detection(image_bytes, options, progress=None):
+    """Run detection on an upload, answering from the result cache when possible."""
+    cache_key = None
+    if result_cache is not None:
+        with stage('cache_lookup'):
+            cache_key = ResultCache.make_key(
+                image_bytes, registry.get().identity, options["threshold"], options["tiled"],
+                (TILE_OVERLAP, SCREEN_SCALE, SCREEN_THRESHOLD) if options["tiled"] else None,
+                MIN_WELLPAD_AREA, sorted(options["outputs"]), options["tta"]
+            )
+            results = result_cache.get(cache_key)
+        if results is not None:
+            logger.info("Returning cached detection results")
+            store_detections(image_bytes, options, results)
+            return results
     
     try:
-        file.save(filepath)
-        logger.info(f"File saved to {filepath}")
-        
-        results = detect_wellpads(filepath)
-        logger.info("Detection completed successfully")
-        
-        # Convert results to base64
-        mask_base64 = base64.b64encode(results['mask']).decode('utf-8')
-        overlay_base64 = base64.b64encode(results['overlay']).decode('utf-8')
-        
-        # Clean up the uploaded file
-        os.remove(filepath)
-        logger.info(f"Temporary file {filepath} removed")
-        
-        return jsonify({
-            "mask": mask_base64,
-            "overlay": overlay_base64
-        }), 200
+        with stage('decode'):
+            image = decode_image(image_bytes)
+    except ValueError as e:
+        logger.error(f"Invalid image {options['filename']}: {e}")
+        raise BadRequest(str(e))
+    
+    results = detect_wellpads(
+        image,
+        threshold=options["threshold"],
+        tiled=options["tiled"],
+        overlap=TILE_OVERLAP,
+        batch_size=TILE_BATCH_SIZE,
+        predict_fn=batcher.predict if batcher else None,
+        outputs=options["outputs"],
+        min_area=MIN_WELLPAD_AREA,
+        progress=progress,
+        screen_scale=SCREEN_SCALE,
+        screen_threshold=SCREEN_THRESHOLD,
+        tta=options["tta"]
+    )
+    logger.info("Detection completed successfully")
+    
+    if cache_key is not None:
+        with stage('cache_store'):
+            result_cache.put(cache_key, results)
+    store_detections(image_bytes, options, results)
+    return results
+
+def store_detections(image_bytes, options, results):
+    """Add the detections of a georeferenced upload to the detection store."""
+    if detection_store is None or options.get("transform") is None:
+        return
+    # The same image is stored once, whatever the number of uploads
+    source = hashlib.sha256(image_bytes).hexdigest()[:16]
+    with stage('store'):
+        inserted = detection_store.insert_many(from_detections(results['detections'], options["transform"], source))
+    logger.info(f"Stored {inserted} wellpads of {options['filename']}")
+
+def run_detection_job(image_bytes, options, progress=None):
+    """Job body: the results together with the format they are served in."""
+    try:
+        results = run_detection(image_bytes, options, progress=progress)
+    except BadRequest as e:
+        # Reported as a client error by the job API, not as a server failure
+        raise ClientError(e.description, status_code=e.code)
+    return {"response_format": options["response_format"], "results": results}
+
+@app.route('/api/detect', methods=['POST'])
+def detect():
+    try:
+        with profiler.sample('detect'):
+            image_bytes, options = parse_detect_request()
+            results = run_detection(image_bytes, options)
+            return build_response(results, options["response_format"])
+    except BadRequest as e:
+        return jsonify({"error": e.description}), 400
     except Exception as e:
         logger.error(f"Detection failed: {e}")
-        # Clean up the uploaded file in case of error
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                logger.info(f"Cleaned up temporary file {filepath} after error")
-            except Exception as cleanup_error:
-                logger.error(f"Failed to clean up temporary file: {cleanup_error}")
         return jsonify({"error": str(e)}), 500
 
+def job_urls(job_id):
+    return {
+        "status_url": f"/api/jobs/{job_id}",
+        "result_url": f"/api/jobs/{job_id}/result"
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    try:
+        image_bytes, options = parse_detect_request()
+    except BadRequest as e:
+        return jsonify({"error": e.description}), 400
+    
+    try:
+        job_id = job_manager.submit(run_detection_job, image_bytes, options)
+    except QueueFullError as e:
+        logger.warning(f"Rejecting job: {e}")
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+        return response, 429
+    
+    logger.info(f"Queued detection job {job_id}")
+    response = jsonify({"job_id": job_id, "status": "queued", **job_urls(job_id)})
+    response.headers['Location'] = job_urls(job_id)["status_url"]
+    return response, 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify({**status, **job_urls(job_id)}), 200
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    if status["status"] == "failed":
+        return jsonify({"error": status["error"], "job_id": job_id}), status.get("error_status") or 500
+    if status["status"] != "done":
+        # Not finished yet, the client keeps polling
+        return jsonify({**status, **job_urls(job_id)}), 202
+    
+    result = job_manager.result(job_id)
+    if result is None:
+        return jsonify({"error": f"Result of job {job_id} is no longer available"}), 404
+    return build_response(result["results"], result["response_format"])
+
+def parse_detection_query():
+    """
+    Query of GET /api/detections: `bbox` (min_x,min_y,max_x,max_y), or `point` (x,y) with
+    `radius` in coordinate units or `radius_m` in metres, plus `limit` and `cursor`.
+    """
+    limit = int(request.args.get('limit', '100'))
+    if not 1 <= limit <= DETECTION_QUERY_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {DETECTION_QUERY_MAX_LIMIT}, got {limit}")
+    cursor = request.args.get('cursor')
+    if cursor is not None and not cursor.isdigit():
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    bbox = parse_numbers('bbox', 4)
+    point = parse_numbers('point', 2)
+    if (bbox is None) == (point is None):
+        raise ValueError("Provide either bbox or point")
+    if bbox is not None:
+        if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be min_x,min_y,max_x,max_y")
+        return lambda: detection_store.query_bbox(*bbox, limit=limit, cursor=cursor)
+    radius, radius_m = request.args.get('radius'), request.args.get('radius_m')
+    if (radius is None) == (radius_m is None):
+        raise ValueError("point needs either radius or radius_m")
+    meters = radius_m is not None
+    radius = float(radius_m if meters else radius)
+    if radius < 0:
+        raise ValueError(f"radius must not be negative, got {radius}")
+    return lambda: detection_store.query_radius(*point, radius, limit=limit, cursor=cursor, meters=meters)
+
+@app.route('/api/detections', methods=['GET'])
+def query_detections():
+    if detection_store is None:
+        return jsonify({"error": "Detection store is not configured, set DETECTION_STORE_PATH"}), 503
+    try:
+        query = parse_detection_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with stage('store_query'):
+        wellpads, next_cursor = query()
+    return jsonify({"wellpads": wellpads, "count": len(wellpads), "next_cursor": next_cursor}), 200
+
+@app.route('/api/detections', methods=['POST'])
+def insert_detections():
+    """Bulk insert of a GeoJSON FeatureCollection, e.g. written by ml_model.geo."""
+    if detection_store is None:
+        return jsonify({"error": "Detection store is not configured, set DETECTION_STORE_PATH"}), 503
+    collection = request.get_json(silent=True)
+    if not isinstance(collection, dict) or collection.get('type') != 'FeatureCollection':
+        return jsonify({"error": "Expected a GeoJSON FeatureCollection"}), 400
+    try:
+        records = from_geojson(collection, source=request.args.get('source', 'api'))
+    except (KeyError, TypeError, ValueError, IndexError) as e:
+        return jsonify({"error": f"Invalid feature: {e}"}), 400
+    with stage('store'):
+        inserted = detection_store.insert_many(records)
+    logger.info(f"Stored {inserted} of {len(records)} posted wellpads")
+    return jsonify({"received": len(records), "inserted": inserted}), 201
+
 if __name__ == '__main__':
     # Get host from environment variable or default to 0.0.0.0
     host = os.getenv('HOST', '0.0.0.0')
@@ -166,6 +531,5 @@ if __name__ == '__main__':
     logger.info(f"Starting Flask server on {host}:{port}")
     logger.info(f"Environment: {FLASK_ENV}")
     logger.info(f"Model path: {MODEL_PATH}")
-    logger.info(f"Upload folder: {UPLOAD_FOLDER}")
     
     app.run(host=host, port=port, debug=(FLASK_ENV == 'development')) 
\ No newline at end of file
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import logging
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Gathers prediction requests from concurrent callers into batched forward passes.
+
+    Every caller submits a batch of preprocessed images (N, H, W, C) and blocks until its own
+    slice of the predictions is ready. A background thread waits up to max_wait_ms after the
+    first pending request, or until max_batch_size images are queued, then concatenates the
+    pending requests, runs predict_fn once and hands every caller its rows back. Requests whose
+    images have a different shape than the head of the queue are kept for the next batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be positive, got {max_batch_size}")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+
+        # Statistics
+        self._batches = 0
+        self._images = 0
+        self._requests = 0
+        self._batch_sizes = Counter()
+        self._max_queue_depth = 0
+
+    def predict(self, batch):
+        """Submit a batch of images and block until its predictions are available."""
+        return self.submit(batch).result()
+
+    def submit(self, batch):
+        """Submit a batch of images and return a Future resolving to its predictions."""
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.ndim != 4:
+            raise ValueError(f"Expected a batch of shape (N, H, W, C), got {batch.shape}")
+
+        self._ensure_thread()
+        future = Future()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("MicroBatcher has been stopped")
+            self._pending.append((batch, future))
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+            self._condition.notify()
+        return future
+
+    def stop(self):
+        """Stop the background thread once the pending requests are processed."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+
+    def _ensure_thread(self):
+        """
+        Start the background thread on first use. Threads do not survive fork(), so a batcher
+        created before gunicorn forks its workers gets a fresh queue and thread in each worker.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._condition = threading.Condition()
+                self._pending = deque()
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stats(self):
+        """Return queue depth and batch size statistics."""
+        with self._condition:
+            return {
+                "queue_depth": len(self._pending),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": self._batches,
+                "images": self._images,
+                "mean_batch_size": self._images / self._batches if self._batches else 0.0,
+                "batch_sizes": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0
+            }
+
+    def _queued_images(self):
+        return sum(len(batch) for batch, _ in self._pending)
+
+    def _collect(self):
+        """Wait for a full batch or for the deadline and take the matching requests off the queue."""
+        with self._condition:
+            while not self._pending and not self._stopped:
+                self._condition.wait()
+            if not self._pending:
+                return []
+
+            deadline = time.monotonic() + self.max_wait
+            while not self._stopped and self._queued_images() < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            shape = self._pending[0][0].shape[1:]
+            taken, kept, size = [], deque(), 0
+            while self._pending:
+                batch, future = self._pending.popleft()
+                # The head of the queue is always taken, even if it is larger than max_batch_size
+                fits = not taken or size + len(batch) <= self.max_batch_size
+                if batch.shape[1:] == shape and fits:
+                    taken.append((batch, future))
+                    size += len(batch)
+                else:
+                    kept.append((batch, future))
+            self._pending = kept
+            return taken
+
+    def _run(self):
+        while True:
+            taken = self._collect()
+            if not taken:
+                return
+
+            futures = [future for _, future in taken]
+            sizes = [len(batch) for batch, _ in taken]
+            try:
+                batch = taken[0][0] if len(taken) == 1 else np.concatenate([b for b, _ in taken], axis=0)
+                preds = np.asarray(self.predict_fn(batch))
+            except Exception as e:
+                logger.error(f"Batched prediction failed: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            with self._condition:
+                self._batches += 1
+                self._images += len(batch)
+                self._batch_sizes[len(batch)] += 1
+
+            offset = 0
+            for future, size in zip(futures, sizes):
+                future.set_result(preds[offset:offset + size])
+                offset += size
@@ -0,0 +1,347 @@
+"""
+Reproducible performance benchmarks of the inference and training pipelines.
+
+Every suite runs on synthetic images and TFRecords generated locally from a fixed seed, so
+runs on different commits measure the same work. Results are written as JSON and two result
+files can be compared:
+
+    python -m ml_model.benchmark run -o bench/base.json
+    python -m ml_model.benchmark run -o bench/new.json --suites detect,model
+    python -m ml_model.benchmark compare bench/base.json bench/new.json --threshold 0.1
+
+compare exits with status 1 when a metric got worse by more than the threshold.
+
+Suites:
+    detect        detect_wellpads latency percentiles per image size, resized and tiled
+    model         batched model throughput per batch size
+    dataset       WellpadDataset input throughput, per-example and batch-first pipelines
+    augmentation  BatchAugmenter throughput
+    http          /api/detect throughput and latency under concurrent clients
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SUITES = ('detect', 'model', 'dataset', 'augmentation', 'http')
+
+# Workload sizes, the quick variant is meant for a fast check on a laptop or in CI
+CONFIG = {
+    'full': {
+        'image_sizes': [256, 512, 1024, 2048],
+        'detect_runs': 20,
+        'batch_sizes': [1, 2, 4, 8, 16, 32],
+        'model_runs': 10,
+        'records': 512,
+        'augment_batches': 50,
+        'concurrency': [1, 4, 8],
+        'http_requests': 64,
+    },
+    'quick': {
+        'image_sizes': [256, 512],
+        'detect_runs': 5,
+        'batch_sizes': [1, 8],
+        'model_runs': 3,
+        'records': 64,
+        'augment_batches': 10,
+        'concurrency': [1, 4],
+        'http_requests': 16,
+    },
+}
+
+
+def synthetic_image(size, seed=0):
+    """RGB uint8 scene of size x size: textured background with a few bright rectangular pads."""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(40, 120, size=(size, size, 3), dtype=np.uint8)
+    for _ in range(max(1, size // 128)):
+        w, h = rng.integers(8, max(9, size // 8), size=2)
+        x, y = rng.integers(0, size - w), rng.integers(0, size - h)
+        img[y:y + h, x:x + w] = rng.integers(180, 255, size=3, dtype=np.uint8)
+    return img
+
+
+def encode_png(img):
+    ok, data = cv2.imencode('.png', cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError("Could not encode image")
+    return data.tobytes()
+
+
+def write_tfrecords(directory, num_records, num_shards=4, size=256, seed=0):
+    """Write GZIP TFRecord shards in the layout WellpadDataset reads and return their pattern."""
+    import tensorflow as tf
+    rng = np.random.default_rng(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    options = tf.io.TFRecordOptions(compression_type='GZIP')
+    for shard in range(num_shards):
+        with tf.io.TFRecordWriter(str(directory / f'synthetic-{shard:02d}.tfrecord.gz'), options) as writer:
+            for _ in range(shard, num_records, num_shards):
+                bands = rng.random((3, size, size), dtype=np.float32)
+                label = (rng.random((size, size)) > 0.9).astype(np.float32)
+                feature = {
+                    name: tf.train.Feature(float_list=tf.train.FloatList(value=values.ravel()))
+                    for name, values in zip(['R', 'G', 'B', 'Label'], list(bands) + [label])
+                }
+                writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+    return str(directory / 'synthetic-*.tfrecord.gz')
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {f'p{q}': round(float(np.percentile(samples, q)), 3) for q in (50, 90, 99)}
+
+
+class Results:
+    """Collects metrics as flat records: suite, name, metric, value, unit and direction."""
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, suite, name, metric, value, unit, higher_is_better):
+        record = {
+            'suite': suite,
+            'name': name,
+            'metric': metric,
+            'value': round(float(value), 4),
+            'unit': unit,
+            'higher_is_better': higher_is_better
+        }
+        self.records.append(record)
+        logger.info(f"{suite}/{name} {metric}: {record['value']} {unit}")
+
+    def add_latency(self, suite, name, timings):
+        for metric, value in percentiles(timings).items():
+            self.add(suite, name, metric, value, 'ms', False)
+
+
+def bench_detect(results, config):
+    from ml_model.detect import detect_wellpads
+    for size in config['image_sizes']:
+        img = synthetic_image(size, seed=size)
+        modes = [('resized', False)] + ([('tiled', True)] if size > 256 else [])
+        for mode, tiled in modes:
+            detect_wellpads(img, tiled=tiled, outputs=('mask',))
+            timings = []
+            for _ in range(config['detect_runs']):
+                start = time.perf_counter()
+                detect_wellpads(img, tiled=tiled, outputs=('mask',))
+                timings.append(time.perf_counter() - start)
+            results.add_latency('detect', f'{mode}_{size}', timings)
+
+
+def bench_model(results, config):
+    from ml_model.detect import predict_batch
+    rng = np.random.default_rng(0)
+    for batch_size in config['batch_sizes']:
+        batch = rng.random((batch_size, 256, 256, 3), dtype=np.float32)
+        predict_batch(batch)
+        timings = []
+        for _ in range(config['model_runs']):
+            start = time.perf_counter()
+            predict_batch(batch)
+            timings.append(time.perf_counter() - start)
+        median = float(np.median(timings))
+        results.add('model', f'batch_{batch_size}', 'images_per_sec', batch_size / median, 'images/s', True)
+        results.add('model', f'batch_{batch_size}', 'p50', 1000 * median, 'ms', False)
+
+
+def _examples_per_sec(dataset):
+    """Examples per second of one full pass over a dataset of batches or single examples."""
+    examples = 0
+    start = time.perf_counter()
+    for image, _ in dataset:
+        examples += image.shape[0] if len(image.shape) == 4 else 1
+    return examples / (time.perf_counter() - start)
+
+
+def bench_dataset(results, config, pattern):
+    from ml_model.facility.data import WellpadDataset
+    results.add('dataset', 'get', 'examples_per_sec',
+                _examples_per_sec(WellpadDataset().get(pattern)), 'examples/s', True)
+    for batch_size in (16, 64):
+        dataset = WellpadDataset().get_batched(pattern, batch_size=batch_size)
+        results.add('dataset', f'get_batched_{batch_size}', 'examples_per_sec',
+                    _examples_per_sec(dataset), 'examples/s', True)
+
+
+def bench_augmentation(results, config):
+    import tensorflow as tf
+    from ml_model.facility.augmentation import BatchAugmenter
+    rng = np.random.default_rng(0)
+    images = rng.random((16, 256, 256, 3), dtype=np.float32)
+    masks = (rng.random((16, 256, 256, 1)) > 0.9).astype(np.float32)
+    for num_versions in (1, 4):
+        batches = tf.data.Dataset.from_tensors((images, masks)).repeat(config['augment_batches'])
+        dataset = BatchAugmenter(num_versions=num_versions, seed=0)(batches)
+        # The first pass traces the map function
+        for _ in dataset.take(1):
+            pass
+        results.add('augmentation', f'versions_{num_versions}', 'examples_per_sec',
+                    _examples_per_sec(dataset), 'examples/s', True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def bench_http(results, config):
+    import requests
+    from werkzeug.serving import make_server
+    # Every request must reach the model
+    os.environ['RESULT_CACHE_SIZE'] = '0'
+    os.environ.pop('RESULT_CACHE_DIR', None)
+    from ml_model.app import app
+
+    port = _free_port()
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{port}/api/detect'
+    # Distinct images so no layer can answer from a cache
+    uploads = [encode_png(synthetic_image(512, seed=i)) for i in range(config['http_requests'])]
+
+    def post(data):
+        start = time.perf_counter()
+        response = requests.post(url, files={'image': ('scene.png', data, 'image/png')}, params={'format': 'rle'})
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    try:
+        post(uploads[0])
+        for concurrency in config['concurrency']:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                start = time.perf_counter()
+                timings = list(pool.map(post, uploads))
+                elapsed = time.perf_counter() - start
+            name = f'concurrency_{concurrency}'
+            results.add('http', name, 'requests_per_sec', len(uploads) / elapsed, 'requests/s', True)
+            results.add_latency('http', name, timings)
+    finally:
+        server.shutdown()
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+    import tensorflow as tf
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'tensorflow': tf.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'model_path': os.getenv('MODEL_PATH'),
+        'inference_backend': os.getenv('INFERENCE_BACKEND', 'keras')
+    }
+
+
+def run(suites=SUITES, quick=False, work_dir=None):
+    """Run the suites and return the results document."""
+    config = CONFIG['quick' if quick else 'full']
+    results = Results()
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        pattern = None
+        if 'dataset' in suites:
+            pattern = write_tfrecords(Path(tmp) / 'tfrecords', config['records'])
+        for suite in suites:
+            logger.info(f"Running suite {suite}")
+            start = time.perf_counter()
+            if suite == 'dataset':
+                bench_dataset(results, config, pattern)
+            else:
+                globals()[f'bench_{suite}'](results, config)
+            logger.info(f"Suite {suite} finished in {time.perf_counter() - start:.1f}s")
+    return {'meta': dict(_metadata(), quick=quick, suites=list(suites)), 'results': results.records}
+
+
+def compare(base, new, threshold=0.1):
+    """
+    Compare two results documents metric by metric.
+
+    Returns:
+        tuple: (rows, regressions); every row holds the key, both values and the relative change,
+            positive when the metric improved.
+    """
+    base_values = {(r['suite'], r['name'], r['metric']): r for r in base['results']}
+    rows, regressions = [], []
+    for record in new['results']:
+        key = (record['suite'], record['name'], record['metric'])
+        previous = base_values.get(key)
+        if previous is None or previous['value'] == 0:
+            continue
+        change = (record['value'] - previous['value']) / abs(previous['value'])
+        if not record['higher_is_better']:
+            change = -change
+        row = {'key': '/'.join(key), 'base': previous['value'], 'new': record['value'],
+               'unit': record['unit'], 'change': round(change, 4) or 0.0}
+        rows.append(row)
+        if change < -threshold:
+            regressions.append(row)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the benchmark suites')
+    run_parser.add_argument('-o', '--output', required=True, help='Results JSON file')
+    run_parser.add_argument('--suites', default=','.join(SUITES), help='Comma separated suites')
+    run_parser.add_argument('--quick', action='store_true', help='Smaller workloads for a fast check')
+    run_parser.add_argument('--work-dir', default=None, help='Where the synthetic TFRecords are written')
+
+    compare_parser = commands.add_parser('compare', help='Compare two results files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Relative change beyond which a worse metric counts as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        suites = [suite.strip() for suite in args.suites.split(',') if suite.strip()]
+        unknown = set(suites) - set(SUITES)
+        if unknown:
+            parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+        document = run(suites, quick=args.quick, work_dir=args.work_dir)
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(document, indent=2))
+        print(f"Wrote {len(document['results'])} results to {output}")
+        return 0
+
+    base = json.loads(Path(args.base).read_text())
+    new = json.loads(Path(args.new).read_text())
+    rows, regressions = compare(base, new, args.threshold)
+    print(f"base {base['meta'].get('commit')}  new {new['meta'].get('commit')}")
+    for row in rows:
+        flag = '  REGRESSION' if row in regressions else ''
+        print(f"{row['key']:<45} {row['base']:>12} {row['new']:>12} {row['unit']:<11} {row['change']:+8.1%}{flag}")
+    print(f"{len(regressions)} regressions beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
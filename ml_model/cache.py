@@ -0,0 +1,186 @@
+import os
+import pickle
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Two-tier cache of detection results keyed by a hash of the image bytes and the settings.
+
+    The memory tier is an LRU bounded by number of entries and total size. The optional disk
+    tier keeps pickled results below disk_dir and evicts the least recently used files once
+    their total size exceeds disk_max_bytes. The disk directory can be shared by several
+    worker processes; each process tracks the files it has seen, so the size bound is
+    enforced per process.
+    """
+
+    def __init__(self, max_items=256, max_bytes=256 * 1024 * 1024, disk_dir=None,
+                 disk_max_bytes=1024 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+
+        # Statistics
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(data, *settings):
+        """Hash of the image bytes together with everything else that changes the result."""
+        digest = hashlib.sha256(data)
+        for setting in settings:
+            digest.update(b'\0' + repr(setting).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached results of key, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return entry[0]
+
+        results = self._read_disk(key)
+        with self._lock:
+            if results is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+        self._put_memory(key, results, len(pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL)))
+        return results
+
+    def put(self, key, results):
+        """Store results in the memory tier and, if configured, the disk tier."""
+        data = pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL)
+        self._put_memory(key, results, len(data))
+        if self.disk_dir is not None:
+            self._write_disk(key, data)
+
+    def stats(self):
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            lookups = self._memory_hits + self._disk_hits + self._misses
+            return {
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": (self._memory_hits + self._disk_hits) / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_items": len(self._disk) if self.disk_dir is not None else None,
+                "disk_bytes": self._disk_bytes if self.disk_dir is not None else None
+            }
+
+    def _put_memory(self, key, results, size):
+        if self.max_items <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous[1]
+            self._memory[key] = (results, size)
+            self._memory_bytes += size
+            while len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self._evictions += 1
+
+    def _path(self, key):
+        return self.disk_dir / key[:2] / f'{key}.pkl'
+
+    def _scan_disk(self):
+        """Index the files left by previous runs, least recently used first."""
+        files = []
+        for path in self.disk_dir.glob('*/*.pkl'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+        logger.info(f"Result cache found {len(self._disk)} entries ({self._disk_bytes} bytes) in {self.disk_dir}")
+        self._evict_disk()
+
+    def _read_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            results = pickle.loads(data)
+            # Touch the file so the least recently used order survives restarts
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove_disk(key)
+            return None
+        with self._lock:
+            if key not in self._disk:
+                self._disk_bytes += len(data)
+            self._disk[key] = len(data)
+            self._disk.move_to_end(key)
+        return results
+
+    def _write_disk(self, key, data):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write cache entry {path}: {e}")
+            return
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+        self._evict_disk()
+
+    def _remove_disk(self, key):
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict_disk(self):
+        while True:
+            with self._lock:
+                if self._disk_bytes <= self.disk_max_bytes or not self._disk:
+                    return
+                key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._evictions += 1
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
@@ -5,6 +5,19 @@ import logging
 from pathlib import Path
 import cv2
 import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ml_model.registry import ModelRegistry
+from ml_model.encoding import mask_to_rle, mask_to_polygons
+from ml_model.postprocess import describe_detections
+from ml_model.metrics import metrics, stage, observe_image, TILES
+from ml_model.facility.augmentation import dihedral_variant, DIHEDRAL_VARIANTS
 
 # Configure logging
 logging.basicConfig(
@@ -30,40 +43,167 @@ def dice_loss(y_true, y_pred):
 def bce_dice_loss(y_true, y_pred):
     return tf.keras.losses.binary_crossentropy(y_true, y_pred) + dice_loss(y_true, y_pred)
 
-# Initialize model as None
-model = None
+class InferenceEngine:
+    """
+    Wraps the Keras model in a tf.function traced once with a fixed input signature.
 
-def load_model():
+    model.predict sets up a full predict loop (data adapter, callbacks, progress bar) on every
+    call; calling the traced graph directly skips all of it. The batch dimension is left
+    unconstrained so every batch size reuses the same concrete function.
     """
-    Load the model with proper error handling and logging.
+
+    def __init__(self, keras_model, identity=None):
+        self.model = keras_model
+        # Identifies the weights, e.g. to key cached results
+        self.identity = identity or keras_model.name
+        self.input_shape = tuple(keras_model.input_shape[1:])
+        self._forward = tf.function(
+            self.__forward,
+            input_signature=[tf.TensorSpec(shape=(None,) + self.input_shape, dtype=tf.float32)]
+        )
+
+    def __forward(self, batch):
+        return self.model(batch, training=False)
+
+    def __call__(self, batch):
+        """Run the model on a batch of preprocessed images and return the probabilities."""
+        batch = tf.convert_to_tensor(batch, dtype=tf.float32)
+        return self._forward(batch).numpy()
+
+    def warmup(self, batch_sizes=(1,)):
+        """Trace the graph and run it once per batch size so the first request is not slow."""
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            self(np.zeros((batch_size,) + self.input_shape, dtype=np.float32))
+            logger.info(f"Warmed up inference for batch size {batch_size} in {time.perf_counter() - start:.3f}s")
+
+def _tflite_interpreter_class():
+    """The standalone LiteRT interpreter if installed, otherwise the one bundled with TensorFlow."""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+class TFLiteEngine:
     """
-    global model
-    if model is not None:
-        logger.info("Model already loaded")
-        return model
+    Serves a TFLite model exported by ml_model.export with the interface of InferenceEngine.
+
+    A TFLite interpreter has fixed tensor sizes, so batches are padded to the next power of two
+    and one interpreter is kept per padded size. Interpreters are not thread-safe; calls are
+    serialized, which matches the micro-batcher that feeds the engine from a single thread.
+    Quantized (int8/uint8) inputs and outputs are converted from and to float32.
+    """
+
+    def __init__(self, model_path, identity=None, num_threads=None):
+        self.model = None
+        self.model_path = str(model_path)
+        self.identity = identity or self.model_path
+        self.num_threads = num_threads
+        self._interpreter_class = _tflite_interpreter_class()
+        self._interpreters = {}
+        self._lock = threading.Lock()
+        interpreter = self.__interpreter(1)
+        self.input_shape = tuple(int(d) for d in interpreter.get_input_details()[0]['shape'][1:])
+
+    def __interpreter(self, batch_size):
+        interpreter = self._interpreters.get(batch_size)
+        if interpreter is None:
+            interpreter = self._interpreter_class(model_path=self.model_path, num_threads=self.num_threads)
+            detail = interpreter.get_input_details()[0]
+            if detail['shape'][0] != batch_size:
+                interpreter.resize_tensor_input(detail['index'], [batch_size] + list(detail['shape'][1:]), strict=False)
+            interpreter.allocate_tensors()
+            self._interpreters[batch_size] = interpreter
+        return interpreter
+
+    def __call__(self, batch):
+        """Run the model on a batch of preprocessed images and return the probabilities."""
+        batch = np.asarray(batch, dtype=np.float32)
+        count = len(batch)
+        padded_size = 1 << max(count - 1, 0).bit_length()
+        if padded_size != count:
+            batch = np.concatenate([batch, np.zeros((padded_size - count,) + batch.shape[1:], dtype=np.float32)])
+
+        with self._lock:
+            interpreter = self.__interpreter(padded_size)
+            input_detail = interpreter.get_input_details()[0]
+            output_detail = interpreter.get_output_details()[0]
+            interpreter.set_tensor(input_detail['index'], self.__quantize(batch, input_detail))
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_detail['index'])
+        return self.__dequantize(output, output_detail)[:count]
+
+    @staticmethod
+    def __quantize(values, detail):
+        if detail['dtype'] == np.float32:
+            return values
+        scale, zero_point = detail['quantization']
+        info = np.iinfo(detail['dtype'])
+        return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(detail['dtype'])
+
+    @staticmethod
+    def __dequantize(values, detail):
+        if detail['dtype'] == np.float32:
+            return values.copy()
+        scale, zero_point = detail['quantization']
+        return ((values.astype(np.float32) - zero_point) * scale).astype(np.float32)
+
+    def warmup(self, batch_sizes=(1,)):
+        """Create and run the interpreter of every batch size once so the first request is not slow."""
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            self(np.zeros((batch_size,) + self.input_shape, dtype=np.float32))
+            logger.info(f"Warmed up TFLite inference for batch size {batch_size} in {time.perf_counter() - start:.3f}s")
+
+# 'keras' serves the .keras model, 'tflite' a .tflite model exported by ml_model.export (set MODEL_PATH to it)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'keras').lower()
+# Threads per TFLite interpreter, 0 lets the runtime decide
+TFLITE_THREADS = int(os.getenv('TFLITE_THREADS', '0')) or None
+
+# Batch sizes the engine is warmed up for at load time
+WARMUP_BATCH_SIZES = [int(size) for size in os.getenv('WARMUP_BATCH_SIZES', '1,8,16').split(',') if size.strip()]
+
+def resolve_model_path():
+    """
+    Find the model file from the MODEL_PATH environment variable or the known fallback locations.
+    """
+    # Get configuration from environment variables
+    MODEL_PATH = Path(os.getenv('MODEL_PATH', str(Path(__file__).parent / 'results' / '2025-04-09_wellpad_model_.keras')))
+    
+    logger.info(f"Attempting to load model from: {MODEL_PATH}")
+    if not MODEL_PATH.exists():
+        logger.warning(f"Model file not found at {MODEL_PATH}")
+        # Try alternative paths
+        alternative_paths = [
+            Path('/app/ml_model/results/2025-04-09_wellpad_model_.keras'),  # Docker container path
+            Path(__file__).parent / 'results' / '2025-04-09_wellpad_model_.keras',  # Local development path
+            Path('ml_model/results/2025-04-09_wellpad_model_.keras'),  # Relative path
+            Path('/app/ml_model/results/2025-04-09_wellpad_model_.keras')  # Absolute Docker path
+        ]
+        for path in alternative_paths:
+            if path.exists():
+                MODEL_PATH = path
+                logger.info(f"Found model at alternative path: {MODEL_PATH}")
+                break
         
+    if not MODEL_PATH.exists():
+        raise FileNotFoundError(f"Model file not found at any of the checked paths")
+    return MODEL_PATH
+
+def model_identity(model_path):
+    """
+    Identifies a model file by its path, size and modification time.
+    """
+    stat = model_path.stat()
+    return f"{model_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def _load_engine():
+    """
+    Load the model with proper error handling and logging and wrap it in an InferenceEngine.
+    """
     try:
-        # Get configuration from environment variables
-        MODEL_PATH = Path(os.getenv('MODEL_PATH', str(Path(__file__).parent / 'results' / '2025-04-09_wellpad_model_.keras')))
-        
-        logger.info(f"Attempting to load model from: {MODEL_PATH}")
-        if not MODEL_PATH.exists():
-            logger.warning(f"Model file not found at {MODEL_PATH}")
-            # Try alternative paths
-            alternative_paths = [
-                Path('/app/ml_model/results/2025-04-09_wellpad_model_.keras'),  # Docker container path
-                Path(__file__).parent / 'results' / '2025-04-09_wellpad_model_.keras',  # Local development path
-                Path('ml_model/results/2025-04-09_wellpad_model_.keras'),  # Relative path
-                Path('/app/ml_model/results/2025-04-09_wellpad_model_.keras')  # Absolute Docker path
-            ]
-            for path in alternative_paths:
-                if path.exists():
-                    MODEL_PATH = path
-                    logger.info(f"Found model at alternative path: {MODEL_PATH}")
-                    break
-            
-        if not MODEL_PATH.exists():
-            raise FileNotFoundError(f"Model file not found at any of the checked paths")
+        MODEL_PATH = resolve_model_path()
             
         # Verify file is readable
         if not os.access(str(MODEL_PATH), os.R_OK):
@@ -82,6 +222,17 @@ def load_model():
         except Exception as e:
             raise ValueError(f"Error reading model file: {str(e)}")
             
+        identity = model_identity(MODEL_PATH)
+        if INFERENCE_BACKEND == 'tflite':
+            if MODEL_PATH.suffix != '.tflite':
+                raise ValueError(f"INFERENCE_BACKEND=tflite needs a .tflite model, got {MODEL_PATH}")
+            logger.info(f"Loading TFLite model with {TFLITE_THREADS or 'default'} threads...")
+            engine = TFLiteEngine(MODEL_PATH, identity=identity, num_threads=TFLITE_THREADS)
+            logger.info(f"TFLite model loaded, input shape: {engine.input_shape}")
+            return engine
+        if INFERENCE_BACKEND != 'keras':
+            raise ValueError(f"Unknown INFERENCE_BACKEND '{INFERENCE_BACKEND}', expected 'keras' or 'tflite'")
+
         # Load the model with custom objects
         custom_objects = {
             'bce_dice_loss': bce_dice_loss,
@@ -99,18 +250,19 @@ def load_model():
         logger.info("Model loaded successfully")
         logger.info(f"Model input shape: {model.input_shape}")
         logger.info(f"Model output shape: {model.output_shape}")
-        return model
+        return InferenceEngine(model, identity=identity)
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
-        model = None
         raise
 
-# Try to load the model on import
-try:
-    load_model()
-except Exception as e:
-    logger.error(f"Failed to load model during import: {e}")
-    # Don't raise here, let the application handle it
+# The model is loaded once per process, on first use or when the server preloads it
+registry = ModelRegistry(_load_engine, warmup_batch_sizes=WARMUP_BATCH_SIZES)
+
+def load_model():
+    """
+    Return the Keras model of this process, loading it on first use (None with the TFLite backend).
+    """
+    return registry.get().model
 
 def preprocess_full_image(img, target_size=(256, 256)):
     """
@@ -128,60 +280,613 @@ def preprocess_full_image(img, target_size=(256, 256)):
         logger.error(f"Error preprocessing image: {e}")
         raise
 
-def detect_wellpads(image_path, target_size=(256, 256), threshold=0.5):
+def predict_batch(batch):
+    """
+    Runs the model on a batch of preprocessed images and returns the probabilities as a NumPy array.
+    """
+    return registry.get()(batch)
+
+@tf.function(reduce_retracing=True)
+def _dihedral_variants(batch, variants):
+    """Every variant of the batch, variant-major: rows [v * N, (v + 1) * N) hold variant v."""
+    return tf.concat([dihedral_variant(batch, variant) for variant in variants], axis=0)
+
+@tf.function(reduce_retracing=True)
+def _average_variants(preds, variants):
+    """Maps the predictions of every variant block back and averages them."""
+    blocks = tf.split(preds, len(variants), axis=0)
+    restored = [dihedral_variant(block, variant, inverse=True) for block, variant in zip(blocks, variants)]
+    return tf.add_n(restored) / len(variants)
+
+def predict_tta(batch, predict_fn=None, variants=DIHEDRAL_VARIANTS):
+    """
+    Test-time augmentation: predicts every flip and 90° rotation of the images and averages
+    the predictions mapped back onto the original images.
+
+    All variants go through the model as one batch len(variants) times larger, built and
+    undone with the flips and transposition of the training augmentation.
+
+    Parameters:
+        batch: Preprocessed square images of shape (N, H, H, C).
+        predict_fn (callable): Function mapping a batch of images to probabilities.
+        variants (tuple): (flip_lr, flip_ud, transpose) flags of the variants.
+
+    Returns:
+        np.ndarray: Averaged probabilities of shape (N, H, H, 1).
+    """
+    predict_fn = predict_fn or predict_batch
+    variants = tuple(tuple(bool(flag) for flag in variant) for variant in variants)
+    augmented = _dihedral_variants(tf.convert_to_tensor(batch, dtype=tf.float32), variants)
+    preds = predict_fn(augmented.numpy())
+    return _average_variants(tf.convert_to_tensor(preds, dtype=tf.float32), variants).numpy()
+
+def _tile_starts(length, tile_size, stride):
+    """
+    Returns the start offsets of the windows along one axis. The last window is aligned
+    with the end of the axis so every pixel is covered.
+    """
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
+    return starts
+
+def window_positions(height, width, tile_size=256, overlap=32):
+    """Returns the (y, x) offsets of the windows covering an image of at least tile_size x tile_size."""
+    stride = tile_size - overlap
+    return [(y, x)
+            for y in _tile_starts(height, tile_size, stride)
+            for x in _tile_starts(width, tile_size, stride)]
+
+def _tile_weights(tile_size, overlap):
+    """
+    Builds the 2D blending weights of a window: a linear ramp across the overlap band on each
+    side and 1 in the interior, so neighbouring windows fade into each other instead of
+    producing seams at the window borders.
+    """
+    if overlap <= 0:
+        return np.ones((tile_size, tile_size), dtype=np.float32)
+    idx = np.arange(tile_size, dtype=np.float32)
+    ramp = np.minimum(idx + 1, tile_size - idx) / float(overlap + 1)
+    ramp = np.clip(ramp, 1e-3, 1.0)
+    return np.outer(ramp, ramp).astype(np.float32)
+
+def screen_windows(img, positions, tile_size=256, scale=4, threshold=0.1, margin=2, overlap=32,
+                   batch_size=8, predict_fn=None):
+    """
+    Coarse pass of the screening: predicts the image downsampled by scale and keeps the windows
+    whose footprint, grown by margin coarse pixels, reaches threshold anywhere.
+
+    The coarse pass costs about 1/scale^2 of the full-resolution one. Wellpads shrink by the
+    same factor, so the threshold is meant to be low; recall is traded for speed by raising
+    it or the scale.
+
+    Parameters:
+        img (np.ndarray): RGB image of shape (H, W, 3), uint8.
+        positions (list): (y, x) offsets of the windows in img.
+        scale (float): Downsampling factor of the coarse pass.
+        threshold (float): Coarse probability from which a window is predicted at full resolution.
+        margin (int): Coarse pixels added around every window footprint.
+        predict_fn (callable): Model of the coarse pass, e.g. a lighter student. Defaults to the
+            loaded model.
+
+    Returns:
+        np.ndarray: Boolean array, True for the windows to predict.
     """
-    Detects wellpads in the image using the model. Processes the entire image without tiling.
+    height, width = img.shape[:2]
+    small = cv2.resize(img, (max(1, round(width / scale)), max(1, round(height / scale))),
+                       interpolation=cv2.INTER_AREA)
+    coarse = predict_tiled(small, tile_size=tile_size, overlap=overlap, batch_size=batch_size,
+                           predict_fn=predict_fn)
+
+    # Summed-area table of the hot pixels, every window is then checked in constant time
+    integral = cv2.integral((coarse >= threshold).astype(np.uint8))
+    fy, fx = small.shape[0] / height, small.shape[1] / width
+    keep = np.empty(len(positions), dtype=bool)
+    for i, (y, x) in enumerate(positions):
+        y0 = max(int(y * fy) - margin, 0)
+        x0 = max(int(x * fx) - margin, 0)
+        y1 = min(int(np.ceil((y + tile_size) * fy)) + margin, small.shape[0])
+        x1 = min(int(np.ceil((x + tile_size) * fx)) + margin, small.shape[1])
+        keep[i] = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0] > 0
+    return keep
+
+def predict_tiled(img, tile_size=256, overlap=32, batch_size=8, predict_fn=None, progress=None,
+                  screen_scale=0, screen_threshold=0.1, screen_fn=None, tile_cache=None):
+    """
+    Predicts the wellpad probability of every pixel of the image at native resolution.
+
+    The image is cut into overlapping windows of tile_size x tile_size, the windows are sent
+    to the model batch_size at a time and the predictions are blended back together with
+    weights that fade out across the overlap. Only one batch of windows is held in memory
+    at a time.
+
+    With screen_scale above 1 a coarse pass over the downsampled image (see screen_windows)
+    first picks the windows that may contain a wellpad; the others are not predicted and
+    their pixels get probability 0.
+
+    A tile_cache (see ml_model.incremental) is asked for the prediction of every window
+    first, only the windows it has no prediction for are sent to the model and their
+    predictions are handed back to it.
+
+    Parameters:
+        img (np.ndarray): RGB image of shape (H, W, 3), uint8.
+        tile_size (int): Size of the square windows, matching the model input.
+        overlap (int): Number of pixels shared by neighbouring windows.
+        batch_size (int): Number of windows per forward pass.
+        predict_fn (callable): Function mapping a (N, tile, tile, 3) batch to probabilities.
+            Defaults to the loaded model.
+        progress (callable): Called with the fraction of windows predicted after every batch.
+        screen_scale (float): Downsampling factor of the screening pass, 0 disables screening.
+        screen_threshold (float): Coarse probability from which a window is kept.
+        screen_fn (callable): Model of the screening pass. Defaults to predict_fn.
+        tile_cache: Object with get(y, x, window) returning a cached (tile, tile) probability
+            map or None, and put(y, x, window, prob) storing a new one.
+
+    Returns:
+        np.ndarray: Probability map of shape (H, W), float32.
+    """
+    if overlap < 0 or overlap >= tile_size:
+        raise ValueError(f"Overlap must be in [0, {tile_size}), got {overlap}")
+    if batch_size < 1:
+        raise ValueError(f"Batch size must be positive, got {batch_size}")
+    predict_fn = predict_fn or predict_batch
+
+    height, width = img.shape[:2]
+    # Scenes smaller than one window are padded by reflection and cropped afterwards
+    pad_h = max(tile_size - height, 0)
+    pad_w = max(tile_size - width, 0)
+    if pad_h or pad_w:
+        img = np.pad(img, ((0, pad_h), (0, pad_w), (0, 0)), mode='symmetric')
+    padded_h, padded_w = img.shape[:2]
+
+    positions = window_positions(padded_h, padded_w, tile_size, overlap)
+    weights = _tile_weights(tile_size, overlap)
+
+    prob_sum = np.zeros((padded_h, padded_w), dtype=np.float32)
+    weight_sum = np.zeros((padded_h, padded_w), dtype=np.float32)
+    batch = np.empty((batch_size, tile_size, tile_size, 3), dtype=np.float32)
+
+    if screen_scale and screen_scale > 1:
+        with stage('screen'):
+            keep = screen_windows(img, positions, tile_size=tile_size, scale=screen_scale,
+                                  threshold=screen_threshold, overlap=overlap, batch_size=batch_size,
+                                  predict_fn=screen_fn or predict_fn)
+        # Skipped windows still count in the blending weights, with probability 0
+        for (y, x), kept in zip(positions, keep):
+            if not kept:
+                weight_sum[y:y + tile_size, x:x + tile_size] += weights
+        logger.info(f"Screening skipped {int((~keep).sum())} of {len(positions)} windows")
+        metrics.inc(TILES, 'skipped', amount=int((~keep).sum()))
+        positions = [position for position, kept in zip(positions, keep) if kept]
+
+    if tile_cache is not None:
+        with stage('tile_cache'):
+            remaining = []
+            for y, x in positions:
+                cached = tile_cache.get(y, x, img[y:y + tile_size, x:x + tile_size])
+                if cached is None:
+                    remaining.append((y, x))
+                    continue
+                prob_sum[y:y + tile_size, x:x + tile_size] += cached * weights
+                weight_sum[y:y + tile_size, x:x + tile_size] += weights
+        logger.info(f"Reusing {len(positions) - len(remaining)} of {len(positions)} windows from the tile cache")
+        metrics.inc(TILES, 'cached', amount=len(positions) - len(remaining))
+        positions = remaining
+
+    metrics.inc(TILES, 'predicted', amount=len(positions))
+    logger.info(f"Running tiled prediction on {len(positions)} windows of {tile_size}x{tile_size}")
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start:start + batch_size]
+        for i, (y, x) in enumerate(chunk):
+            batch[i] = img[y:y + tile_size, x:x + tile_size]
+        batch[:len(chunk)] /= 255.0
+        with stage('predict'):
+            preds = predict_fn(batch[:len(chunk)])
+        for i, (y, x) in enumerate(chunk):
+            prob_sum[y:y + tile_size, x:x + tile_size] += preds[i, :, :, 0] * weights
+            weight_sum[y:y + tile_size, x:x + tile_size] += weights
+            if tile_cache is not None:
+                tile_cache.put(y, x, img[y:y + tile_size, x:x + tile_size], preds[i, :, :, 0])
+        if progress is not None:
+            progress((start + len(chunk)) / len(positions))
+
+    if progress is not None and not positions:
+        progress(1.0)
+
+    prob = prob_sum / weight_sum
+    return prob[:height, :width]
+
+def decode_image(data):
+    """
+    Decodes an encoded image (PNG, JPEG, ...) from memory into an RGB array without touching the disk.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        raise ValueError("Image data is empty")
+    img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image data")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+def load_image(image):
+    """
+    Returns the RGB uint8 array of an image given as a file path, encoded bytes or a NumPy array.
+    NumPy arrays are expected to be RGB already; grayscale and RGBA arrays are converted.
+    """
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        if image.ndim == 3 and image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
+        if image.ndim == 3 and image.shape[2] == 3:
+            return image
+        raise ValueError(f"Unsupported image array shape {image.shape}")
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return decode_image(image)
+
+    # Anything else is treated as a path to an image file
+    logger.info(f"Reading image from {image}")
+    img = cv2.imread(str(image))
+    if img is None:
+        raise ValueError(f"Could not read image at {image}")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+# Results detect_wellpads can produce
+OUTPUTS = ('mask', 'overlay', 'rle', 'polygons')
+
+def detect_wellpads(image, target_size=(256, 256), threshold=0.5,
+                    tiled=False, overlap=32, batch_size=8, predict_fn=None,
+                    outputs=('mask', 'overlay'), min_area=0, progress=None,
+                    screen_scale=0, screen_threshold=0.1, tta=False, tile_cache=None):
+    """
+    Detects wellpads in the image using the model. By default the entire image is resized to
+    target_size; with tiled=True it is processed at native resolution in overlapping windows.
     
     Parameters:
-        image_path (str): Path to the input image.
-        target_size (tuple): Size to which the image should be resized.
+        image (str | bytes | np.ndarray): Path to the input image, the encoded image bytes
+            (e.g. straight from an upload) or an RGB array.
+        target_size (tuple): Size to which the image should be resized, or the window size when tiled.
         threshold (float): Threshold to convert prediction to binary mask.
+        tiled (bool): Run sliding-window inference at native resolution.
+        overlap (int): Overlap in pixels between neighbouring windows when tiled.
+        batch_size (int): Number of windows per forward pass when tiled.
+        predict_fn (callable): Function mapping a batch of images to probabilities, e.g. a
+            MicroBatcher shared between requests. Defaults to the loaded model.
+        outputs (tuple): Results to produce, any of 'mask' and 'overlay' (PNG bytes), 'rle'
+            (run-length encoded mask) and 'polygons' (region outlines). Outputs that are not
+            requested are not computed.
+        min_area (int): Detected regions smaller than this many pixels are not reported.
+        progress (callable): Called with the completed fraction of the work in [0, 1].
+        screen_scale (float): When tiled, downsampling factor of a coarse screening pass that
+            skips the windows without wellpads (see predict_tiled). 0 disables it.
+        screen_threshold (float): Coarse probability from which a window is predicted.
+        tta (bool): Average the predictions of the eight flips and rotations of every image or
+            window (see predict_tta), at the cost of an eight times larger batch.
+        tile_cache: When tiled, store of window predictions from earlier runs that are reused
+            for unchanged windows (see predict_tiled).
 
     Returns:
-        dict: Dictionary containing the mask and overlay images as bytes.
+        dict: Dictionary containing the requested outputs, the image 'shape' as [height, width]
+            and the 'detections' statistics: per-wellpad boxes, areas, centroids and confidence
+            plus the total coverage percentage.
     """
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f"Unknown outputs {sorted(unknown)}, expected any of {list(OUTPUTS)}")
+
     try:
-        # Ensure model is loaded
-        if model is None:
-            load_model()
-        
-        # Read the image
-        logger.info(f"Reading image from {image_path}")
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not read image at {image_path}")
-        
-        # Convert BGR to RGB
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Preprocess the image
-        img_processed = preprocess_full_image(img, target_size)
+        predict_fn = predict_fn or predict_batch
+        # The screening pass only looks for candidates, it runs without augmentation
+        screen_fn = predict_fn
+        if tta:
+            base_fn = predict_fn
+            predict_fn = lambda batch: predict_tta(batch, base_fn)
         
-        # Add batch dimension and predict
-        img_batch = tf.expand_dims(img_processed, axis=0)
-        logger.info("Running model prediction")
-        pred = model.predict(img_batch)
+        # Decode the image as RGB
+        with stage('load_image'):
+            img = load_image(image)
+        observe_image(img.shape)
         
-        # Remove batch dimension and threshold
-        pred = pred[0, :, :, 0]  # Remove batch and channel dimensions
-        mask = (pred > threshold).astype(np.uint8) * 255
-        
-        # Resize mask to original image size
-        mask = cv2.resize(mask, (img.shape[1], img.shape[0]))
-        
-        # Create overlay
-        overlay = img.copy()
-        overlay[mask > 0] = [255, 0, 0]  # Mark detected areas in red
+        if tiled:
+            # Predict at native resolution, no resize needed
+            # Prediction is by far the longest stage, it accounts for 90% of the progress
+            tile_progress = (lambda fraction: progress(0.9 * fraction)) if progress else None
+            with stage('predict_tiled'):
+                pred = predict_tiled(img, tile_size=target_size[0], overlap=overlap,
+                                     batch_size=batch_size, predict_fn=predict_fn, progress=tile_progress,
+                                     screen_scale=screen_scale, screen_threshold=screen_threshold,
+                                     screen_fn=screen_fn, tile_cache=tile_cache)
+        else:
+            # Preprocess the image
+            with stage('preprocess'):
+                img_processed = preprocess_full_image(img, target_size)
+                
+                # Add batch dimension and predict
+                img_batch = tf.expand_dims(img_processed, axis=0)
+            logger.info("Running model prediction")
+            with stage('predict'):
+                pred = predict_fn(img_batch)
+            
+            # Remove batch and channel dimensions
+            pred = pred[0, :, :, 0]
+            
+            # Resize the probabilities to original image size so mask and statistics line up
+            with stage('resize'):
+                pred = cv2.resize(pred, (img.shape[1], img.shape[0]), interpolation=cv2.INTER_LINEAR)
+            if progress is not None:
+                progress(0.9)
         
-        # Convert to bytes
-        _, mask_bytes = cv2.imencode('.png', mask)
-        _, overlay_bytes = cv2.imencode('.png', overlay)
+        with stage('postprocess'):
+            mask = (pred > threshold).astype(np.uint8) * 255
+            
+            results = {
+                'shape': [int(img.shape[0]), int(img.shape[1])],
+                'detections': describe_detections(mask, pred, min_area=min_area)
+            }
+        if 'mask' in outputs:
+            with stage('encode_mask'):
+                _, mask_bytes = cv2.imencode('.png', mask)
+                results['mask'] = mask_bytes.tobytes()
+        if 'overlay' in outputs:
+            # Create overlay
+            with stage('encode_overlay'):
+                overlay = img.copy()
+                overlay[mask > 0] = [255, 0, 0]  # Mark detected areas in red
+                _, overlay_bytes = cv2.imencode('.png', overlay)
+                results['overlay'] = overlay_bytes.tobytes()
+        if 'rle' in outputs:
+            with stage('encode_rle'):
+                results['rle'] = mask_to_rle(mask)
+        if 'polygons' in outputs:
+            with stage('encode_polygons'):
+                results['polygons'] = mask_to_polygons(mask)
         
+        if progress is not None:
+            progress(1.0)
         logger.info("Detection completed successfully")
-        return {
-            'mask': mask_bytes.tobytes(),
-            'overlay': overlay_bytes.tobytes()
-        }
+        return results
     except Exception as e:
         logger.error(f"Error in detect_wellpads: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# File types picked up when a directory is scanned
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+def list_inputs(source):
+    """
+    Lists the images to process: every image below a directory, or the paths listed one per
+    line in a manifest file (relative paths are resolved against the manifest's directory).
+
+    Returns:
+        tuple: (root directory the outputs are laid out relative to, list of image paths)
+    """
+    source = Path(source)
+    if source.is_dir():
+        paths = sorted(p for p in source.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+        return source, paths
+
+    paths = []
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = Path(line)
+            paths.append(path if path.is_absolute() else source.parent / path)
+    return source.parent, paths
+
+def _output_paths(path, root, output_dir):
+    """Mask and statistics paths of an image, mirroring its location below root."""
+    try:
+        relative = path.resolve().relative_to(root.resolve())
+    except ValueError:
+        relative = Path(path.name)
+    base = Path(output_dir) / relative.parent / relative.stem
+    return base.with_name(base.name + '_mask.png'), base.with_name(base.name + '.json')
+
+def _is_done(stats_path, settings):
+    """Whether the statistics file of an image exists and was written with the same settings."""
+    try:
+        with open(stats_path) as f:
+            return json.load(f).get('settings') == settings
+    except (OSError, ValueError):
+        return False
+
+def _write_outputs(mask_path, stats_path, mask, stats):
+    """Write the mask and then the statistics; the statistics file marks the image as done."""
+    mask_path.parent.mkdir(parents=True, exist_ok=True)
+    if not cv2.imwrite(str(mask_path), mask):
+        raise IOError(f"Could not write mask to {mask_path}")
+    tmp_path = stats_path.with_name(stats_path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, stats_path)
+
+def run_batch(paths, output_dir, root, target_size=(256, 256), threshold=0.5, batch_size=16,
+              workers=4, prefetch=None, tiled=False, overlap=32, min_area=0, resume=True):
+    """
+    Runs detection over many images and writes a mask PNG and a JSON statistics file per image.
+
+    Decoding and preprocessing run in a pool of worker threads that stays up to prefetch images
+    ahead of the model. Without tiling, the preprocessed images of consecutive files are
+    stacked into batches of batch_size for a single forward pass; with tiling every image is
+    predicted at native resolution in batches of batch_size windows.
+
+    Parameters:
+        paths (list): Image paths.
+        output_dir (str): Directory the outputs are written to, mirroring the layout below root.
+        root (Path): Directory the input paths are laid out relative to.
+        workers (int): Number of decode threads.
+        prefetch (int): Maximum number of decoded images waiting for the model.
+        resume (bool): Skip images whose statistics file was written with the same model and
+            settings; images processed with others are processed again.
+
+    Returns:
+        dict: Number of processed, skipped and failed images, the time to load and warm up the
+            model, the time of the first batch, and the elapsed time and images/sec after it.
+    """
+    prefetch = prefetch or 4 * batch_size
+    # Stored in every statistics file, results with other settings are not reused
+    settings = {
+        'model': model_identity(resolve_model_path()),
+        'backend': INFERENCE_BACKEND,
+        'target_size': list(target_size),
+        'threshold': threshold,
+        'tiled': tiled,
+        'overlap': overlap if tiled else None,
+        'min_area': min_area
+    }
+    jobs = []
+    skipped = 0
+    for path in paths:
+        mask_path, stats_path = _output_paths(Path(path), root, output_dir)
+        if resume and _is_done(stats_path, settings):
+            skipped += 1
+            continue
+        jobs.append((Path(path), mask_path, stats_path))
+    logger.info(f"Processing {len(jobs)} images, skipping {skipped} already processed")
+
+    # Loading and warming up the model is timed separately from the detection
+    load_start = time.perf_counter()
+    if jobs:
+        registry.get()
+    load_seconds = time.perf_counter() - load_start
+
+    def decode(job):
+        img = load_image(job[0])
+        if tiled:
+            return img.shape[:2], img
+        return img.shape[:2], np.asarray(preprocess_full_image(img, target_size))
+
+    processed = failed = 0
+    start = time.perf_counter()
+    # The first batch also pays the one-off costs of the pipeline, images/sec is measured after it
+    steady_start, steady_from = None, 0
+
+    def finish(job, pred, shape):
+        nonlocal processed
+        if pred.shape != tuple(shape):
+            pred = cv2.resize(pred, (shape[1], shape[0]), interpolation=cv2.INTER_LINEAR)
+        mask = (pred > threshold).astype(np.uint8) * 255
+        stats = {
+            'image': str(job[0]),
+            'shape': [int(shape[0]), int(shape[1])],
+            'threshold': threshold,
+            'settings': settings,
+            'detections': describe_detections(mask, pred, min_area=min_area)
+        }
+        _write_outputs(job[1], job[2], mask, stats)
+        processed += 1
+        if processed % 100 == 0:
+            logger.info(f"Processed {processed}/{len(jobs)} images "
+                        f"({processed / (time.perf_counter() - start):.2f} images/sec)")
+
+    def flush(pending):
+        nonlocal failed
+        try:
+            preds = predict_batch(np.stack([item for _, _, item in pending]))
+        except Exception as e:
+            logger.error(f"Batch prediction failed: {e}")
+            failed += len(pending)
+            return
+        for (job, shape, _), pred in zip(pending, preds):
+            try:
+                finish(job, pred[:, :, 0], shape)
+            except Exception as e:
+                logger.error(f"Failed to write results for {job[0]}: {e}")
+                failed += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        queue = deque()
+        remaining = iter(jobs)
+        pending = []
+        while True:
+            # Keep the decode pool up to prefetch images ahead of the model
+            while len(queue) < prefetch:
+                job = next(remaining, None)
+                if job is None:
+                    break
+                queue.append((job, executor.submit(decode, job)))
+            if not queue:
+                break
+
+            job, future = queue.popleft()
+            try:
+                shape, item = future.result()
+            except Exception as e:
+                logger.error(f"Failed to read {job[0]}: {e}")
+                failed += 1
+                continue
+
+            if tiled:
+                try:
+                    finish(job, predict_tiled(item, tile_size=target_size[0], overlap=overlap,
+                                              batch_size=batch_size), shape)
+                except Exception as e:
+                    logger.error(f"Detection failed for {job[0]}: {e}")
+                    failed += 1
+            else:
+                pending.append((job, shape, item))
+                if len(pending) < batch_size:
+                    continue
+                flush(pending)
+                pending = []
+            if steady_start is None:
+                steady_start, steady_from = time.perf_counter(), processed
+        if pending:
+            flush(pending)
+
+    end = time.perf_counter()
+    if steady_start is None or processed == steady_from:
+        # Everything fit in the first batch
+        steady_start, steady_from = start, 0
+    elapsed = end - steady_start
+    summary = {
+        'processed': processed,
+        'skipped': skipped,
+        'failed': failed,
+        'load_seconds': round(load_seconds, 3),
+        'first_batch_seconds': round(steady_start - start, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'images_per_second': round((processed - steady_from) / elapsed, 3) if elapsed > 0 else 0.0
+    }
+    logger.info(f"Batch detection finished: {summary}")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Detect wellpads in every image of a directory or manifest file.")
+    parser.add_argument('input', help="Directory of images, or a text file listing one image path per line")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory the masks and statistics are written to")
+    parser.add_argument('--batch-size', type=int, default=16, help="Images (or windows when tiled) per forward pass")
+    parser.add_argument('--workers', type=int, default=4, help="Number of decode threads")
+    parser.add_argument('--prefetch', type=int, default=None, help="Decoded images kept ahead of the model (default 4 x batch size)")
+    parser.add_argument('--threshold', type=float, default=0.5, help="Probability threshold of the mask")
+    parser.add_argument('--min-area', type=int, default=0, help="Ignore detected regions smaller than this many pixels")
+    parser.add_argument('--tiled', action='store_true', help="Predict at native resolution with overlapping windows")
+    parser.add_argument('--overlap', type=int, default=32, help="Window overlap in pixels when tiled")
+    parser.add_argument('--no-resume', action='store_true', help="Reprocess images that already have results")
+    args = parser.parse_args(argv)
+
+    root, paths = list_inputs(args.input)
+    summary = run_batch(
+        paths,
+        args.output_dir,
+        root,
+        threshold=args.threshold,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        prefetch=args.prefetch,
+        tiled=args.tiled,
+        overlap=args.overlap,
+        min_area=args.min_area,
+        resume=not args.no_resume
+    )
+    print(json.dumps(summary))
+    return 0 if summary['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import uuid
+import json
+
+import cv2
+import numpy as np
+
+
+def mask_to_rle(mask):
+    """
+    Run-length encodes a binary mask in the uncompressed COCO layout: pixels are read in
+    column-major order and the counts alternate between background and foreground runs,
+    starting with background.
+
+    Parameters:
+        mask (np.ndarray): Mask of shape (H, W); every non-zero pixel is foreground.
+
+    Returns:
+        dict: {"size": [H, W], "counts": [...]}
+    """
+    flat = np.asarray(mask).ravel(order='F') > 0
+    if flat.size == 0:
+        return {"size": list(mask.shape), "counts": []}
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(boundaries)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": counts.astype(int).tolist()}
+
+
+def rle_to_mask(rle):
+    """Decodes a mask encoded by mask_to_rle back to a uint8 array with values 0 and 255."""
+    height, width = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = (np.arange(len(counts)) % 2).astype(np.uint8) * 255
+    flat = np.repeat(values, counts)
+    return flat.reshape((height, width), order='F')
+
+
+def mask_to_polygons(mask):
+    """
+    Traces the outer boundary of every connected region of the mask.
+
+    Returns:
+        list: One polygon per region, each a list of [x, y] vertices in pixel coordinates.
+    """
+    binary = (np.asarray(mask) > 0).astype(np.uint8)
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [contour[:, 0, :].tolist() for contour in contours]
+
+
+def build_multipart(parts):
+    """
+    Builds a multipart/mixed body.
+
+    Parameters:
+        parts (list): (name, content_type, data) tuples; data is bytes, or any JSON-serializable
+            object for application/json parts.
+
+    Returns:
+        tuple: (body bytes, Content-Type header value)
+    """
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for name, content_type, data in parts:
+        if content_type == 'application/json' and not isinstance(data, (bytes, bytearray)):
+            data = json.dumps(data).encode('utf-8')
+        chunks.append(
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Disposition: attachment; name="{name}"\r\n'
+            f'Content-Length: {len(data)}\r\n\r\n'.encode('utf-8')
+        )
+        chunks.append(bytes(data))
+        chunks.append(b'\r\n')
+    chunks.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(chunks), f'multipart/mixed; boundary={boundary}'
@@ -0,0 +1,264 @@
+"""
+Exports the trained UNet to TFLite and compares the exported models with the original.
+
+Three conversions are available:
+    dynamic  weights stored as int8, activations computed in float32
+    float16  weights stored as float16
+    int8     weights and activations in int8, calibrated on a sample of the TFRecord dataset;
+             the model keeps float32 inputs and outputs
+
+Run from the repository root:
+
+    python -m ml_model.export ml_model/results/2025-04-09_wellpad_model_.keras \\
+        --data "/data/wellpads/*.gz" --modes dynamic,float16,int8 -o ml_model/results/tflite
+
+The report lists, for the original model and every export, the file size, load time,
+memory, latency per batch and the dice score on held-out samples, measured in a fresh process
+per model so the numbers do not influence each other. Memory is the resident size added by
+loading and running the model, on top of the libraries every backend imports. Serve an export with
+INFERENCE_BACKEND=tflite and MODEL_PATH pointing to the .tflite file.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import subprocess
+import logging
+from pathlib import Path
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+MODES = ('dynamic', 'float16', 'int8')
+
+
+def load_keras_model(model_path):
+    """Load the trained model with the custom losses it was compiled with."""
+    from ml_model.detect import bce_dice_loss, dice_loss, dice_coeff
+    custom_objects = {'bce_dice_loss': bce_dice_loss, 'dice_loss': dice_loss, 'dice_coeff': dice_coeff}
+    return tf.keras.models.load_model(str(model_path), custom_objects=custom_objects)
+
+
+def load_samples(pattern, num_samples, skip=0):
+    """
+    Read num_samples (image, mask) examples from the TFRecord files, after skipping the first skip.
+
+    Returns:
+        tuple: (images, masks) as float32 arrays of shape (N, H, W, 3) and (N, H, W, 1).
+    """
+    from ml_model.facility.data import WellpadDataset
+    ds = WellpadDataset().get_batched(pattern, batch_size=32).unbatch().skip(skip).take(num_samples)
+    images, masks = [], []
+    for image, mask in ds:
+        images.append(image.numpy())
+        masks.append(mask.numpy())
+    if not images:
+        raise ValueError(f"No samples could be read from {pattern}")
+    return np.stack(images), np.stack(masks)
+
+
+def convert(model, mode, calibration=None):
+    """
+    Convert a Keras model to a TFLite flatbuffer.
+
+    Parameters:
+        model (tf.keras.Model): The trained model.
+        mode (str): One of MODES.
+        calibration (np.ndarray): Images used to calibrate the activation ranges, needed for int8.
+
+    Returns:
+        bytes: The TFLite model.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {MODES}")
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        # The SavedModel freezes the weights and leaves the batch dimension open
+        model.export(saved_model_dir, verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        return _configure(converter, mode, calibration).convert()
+
+
+def _configure(converter, mode, calibration):
+    """Set the quantization options of mode on the converter."""
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        if calibration is None or len(calibration) == 0:
+            raise ValueError("int8 conversion needs calibration images")
+
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter
+
+
+def export(model_path, output_dir, modes=MODES, calibration=None):
+    """Write one .tflite file per mode next to each other and return {mode: path}."""
+    model = load_keras_model(model_path)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for mode in modes:
+        start = time.perf_counter()
+        data = convert(model, mode, calibration)
+        path = output_dir / f'{Path(model_path).stem}.{mode}.tflite'
+        path.write_bytes(data)
+        logger.info(f"Exported {mode} model to {path} ({len(data)} bytes) in {time.perf_counter() - start:.1f}s")
+        paths[mode] = path
+    return paths
+
+
+def dice(prob, mask, threshold=0.5):
+    """Dice score of the thresholded predictions over all samples."""
+    pred = prob > threshold
+    truth = mask > 0.5
+    total = pred.sum() + truth.sum()
+    return float(2.0 * np.logical_and(pred, truth).sum() / total) if total else 1.0
+
+
+def _rss_mb():
+    """Current resident memory of this process, or the peak where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1e6 if sys.platform == 'darwin' else 1e3
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _measure(backend, model_path, samples_path, output_path, batch_size, repeats, threads):
+    """Runs in a fresh process: load one model, time it and save its predictions."""
+    from ml_model.detect import InferenceEngine, TFLiteEngine
+    images = np.load(samples_path)
+    baseline_mb = _rss_mb()
+
+    start = time.perf_counter()
+    if backend == 'tflite':
+        engine = TFLiteEngine(model_path, num_threads=threads)
+    else:
+        engine = InferenceEngine(load_keras_model(model_path))
+    engine.warmup((1, batch_size))
+    load_seconds = time.perf_counter() - start
+
+    latencies = {}
+    for size in (1, batch_size):
+        batch = images[:size]
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            engine(batch)
+            timings.append(time.perf_counter() - start)
+        latencies[str(size)] = round(1000 * float(np.median(timings)), 2)
+
+    probs = np.concatenate([engine(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+    np.save(output_path, probs)
+    return {
+        'load_seconds': round(load_seconds, 3),
+        'latency_ms': latencies,
+        'baseline_rss_mb': round(baseline_mb, 1),
+        'rss_mb': round(_rss_mb(), 1),
+        'model_rss_mb': round(_rss_mb() - baseline_mb, 1)
+    }
+
+
+def report(model_path, exports, images, masks, batch_size=8, repeats=10, threads=None):
+    """
+    Compare the original model with the exports on the same samples.
+
+    Returns:
+        list: One entry per model with its size, load time, memory, latency, dice against the
+            labels and agreement (dice) with the original model's masks.
+    """
+    models = [('keras', 'original', Path(model_path))] + [('tflite', mode, Path(path)) for mode, path in exports.items()]
+    results = []
+    reference = None
+    with tempfile.TemporaryDirectory() as tmp:
+        samples_path = os.path.join(tmp, 'samples.npy')
+        np.save(samples_path, images)
+        for backend, name, path in models:
+            output_path = os.path.join(tmp, f'{name}.npy')
+            command = [sys.executable, '-m', 'ml_model.export', '--measure', backend, str(path), samples_path,
+                       output_path, '--batch-size', str(batch_size), '--repeats', str(repeats)]
+            if threads:
+                command += ['--threads', str(threads)]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                logger.error(f"Measuring {name} failed: {completed.stderr[-2000:]}")
+                continue
+            result = {'model': name, 'path': str(path), 'size_bytes': path.stat().st_size}
+            result.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+            probs = np.load(output_path)
+            result['dice'] = round(dice(probs, masks), 4)
+            if reference is None:
+                reference = probs
+            result['agreement'] = round(dice(probs, reference > 0.5), 4)
+            results.append(result)
+            logger.info(f"{name}: {result}")
+    return results
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == '--measure':
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--measure', dest='backend', choices=['keras', 'tflite'])
+        parser.add_argument('model_path')
+        parser.add_argument('samples_path')
+        parser.add_argument('output_path')
+        parser.add_argument('--batch-size', type=int, default=8)
+        parser.add_argument('--repeats', type=int, default=10)
+        parser.add_argument('--threads', type=int, default=None)
+        args = parser.parse_args(argv)
+        result = _measure(args.backend, args.model_path, args.samples_path, args.output_path,
+                          args.batch_size, args.repeats, args.threads)
+        print(json.dumps(result))
+        return 0
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='Trained .keras model')
+    parser.add_argument('--data', required=True, help='TFRecord files (glob pattern) for calibration and evaluation')
+    parser.add_argument('--modes', default=','.join(MODES), help='Comma separated conversions')
+    parser.add_argument('-o', '--output-dir', default=None, help='Defaults to the directory of the model')
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--eval-samples', type=int, default=64,
+                        help='Samples for the report, read after the calibration samples (0 skips the report)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--report', default=None, help='Defaults to <output dir>/tflite_report.json')
+    args = parser.parse_args(argv)
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    output_dir = Path(args.output_dir or Path(args.model).parent)
+    calibration = None
+    if 'int8' in modes:
+        calibration, _ = load_samples(args.data, args.calibration_samples)
+    exports = export(args.model, output_dir, modes, calibration)
+
+    if args.eval_samples > 0:
+        skip = args.calibration_samples if calibration is not None else 0
+        images, masks = load_samples(args.data, args.eval_samples, skip=skip)
+        results = report(args.model, exports, images, masks, args.batch_size, args.repeats, args.threads)
+        report_path = Path(args.report or output_dir / 'tflite_report.json')
+        report_path.write_text(json.dumps(results, indent=2))
+        print(f"{'model':>10} {'size MB':>8} {'load s':>7} {'RSS MB':>7} {'b1 ms':>8} {'b' + str(args.batch_size) + ' ms':>8} {'dice':>6} {'agree':>6}")
+        for r in results:
+            print(f"{r['model']:>10} {r['size_bytes'] / 1e6:8.2f} {r['load_seconds']:7.2f} {r['model_rss_mb']:7.1f} "
+                  f"{r['latency_ms']['1']:8.2f} {r['latency_ms'][str(args.batch_size)]:8.2f} {r['dice']:6.3f} {r['agreement']:6.3f}")
+        print(f"Report written to {report_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -1,132 +1,157 @@
+import itertools
+import warnings
 import tensorflow as tf
-import tensorflow.math as Math
-import matplotlib.pyplot as plt
+
+def _translate(images, dx, dy, fill_mode):
+  """Shifts every image of the batch by its own (dx, dy) pixels in a single batched op."""
+  batch_size = tf.shape(images)[0]
+  ones = tf.ones([batch_size], tf.float32)
+  zeros = tf.zeros([batch_size], tf.float32)
+  # Output pixel (x, y) reads input pixel (x + dx, y + dy)
+  transforms = tf.stack([ones, zeros, dx, zeros, ones, dy, zeros, zeros], axis=1)
+  return tf.raw_ops.ImageProjectiveTransformV3(
+    images=images,
+    transforms=transforms,
+    output_shape=tf.shape(images)[1:3],
+    fill_value=0.0,
+    interpolation='NEAREST',
+    fill_mode=fill_mode)
+
+def _select(condition, a, b):
+  """Per-sample choice between two batches, condition has shape [batch]."""
+  return tf.where(tf.reshape(condition, [-1, 1, 1, 1]), a, b)
+
+def dihedral(x, flip_lr, flip_ud, transpose):
+  """
+  Applies per-sample flips and transposition to a batch of shape [B, H, W, C].
+  Together they cover all eight 90° rotations and reflections; transposition
+  requires square images.
+  """
+  x = _select(flip_lr, tf.reverse(x, axis=[2]), x)
+  x = _select(flip_ud, tf.reverse(x, axis=[1]), x)
+  return _select(transpose, tf.transpose(x, [0, 2, 1, 3]), x)
+
+def dihedral_variant(x, variant, inverse=False):
+  """
+  Applies (or with inverse=True undoes) one dihedral variant to the whole batch. The
+  (flip_lr, flip_ud, transpose) flags are Python bools, so only the steps of the
+  variant are computed, unlike the per-sample selection of dihedral.
+  """
+  flip_lr, flip_ud, transpose = variant
+  steps = [(flip_lr, lambda t: tf.reverse(t, axis=[2])),
+           (flip_ud, lambda t: tf.reverse(t, axis=[1])),
+           (transpose, lambda t: tf.transpose(t, [0, 2, 1, 3]))]
+  for flag, step in (reversed(steps) if inverse else steps):
+    if flag:
+      x = step(x)
+  return x
+
+# (flip_lr, flip_ud, transpose) of the eight dihedral variants, the identity first
+DIHEDRAL_VARIANTS = tuple(itertools.product((False, True), repeat=3))
+
+class BatchAugmenter:
+  """
+  Random augmentation of whole batches of image and mask pairs, as a tf.data stage.
+
+  Every sample of a batch gets its own random flips, 90° rotation, translation (up to
+  max_translate of the image size, reflected image borders and empty mask borders) and
+  color scaling, all expressed as batched tensor ops instead of per-example branches.
+  Random numbers are stateless and derived from seed and the index of the batch, so a run
+  is reproducible and the map can run in parallel.
+
+  With num_versions > 1 every batch is returned in that many augmented versions,
+  concatenated along the batch axis, so the batches grow by that factor.
+  """
+  def __init__(self, num_versions=1, seed=0, max_translate=0.1):
+    self.num_versions = num_versions
+    self.seed = seed
+    self.max_translate = max_translate
+
+  def __call__(self, ds):
+    """Augments a dataset of (image, mask) batches."""
+    ds = ds.enumerate()
+    return ds.map(self.augment_indexed, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+
+  def augment_indexed(self, index, batch):
+    img, msk = batch
+    versions = [self.augment(img, msk, tf.stack([tf.cast(self.seed, tf.int64), index * self.num_versions + v]))
+                for v in range(self.num_versions)]
+    if self.num_versions == 1:
+      return versions[0]
+    return tf.concat([v[0] for v in versions], axis=0), tf.concat([v[1] for v in versions], axis=0)
+
+  def augment(self, img, msk, seed):
+    """Augments a batch with the stateless random seed (a shape [2] integer tensor)."""
+    batch_size = tf.shape(img)[0]
+    seeds = tf.random.experimental.stateless_split(seed, num=5)
+
+    def uniform(i, shape, minval, maxval):
+      return tf.random.stateless_uniform(shape, seed=seeds[i], minval=minval, maxval=maxval)
+
+    # Flips and 90° rotations
+    flips = uniform(0, [3, batch_size], 0.0, 1.0) < 0.5
+    square = img.shape[1] is not None and img.shape[1] == img.shape[2]
+    transpose = flips[2] if square else tf.zeros([batch_size], tf.bool)
+    img = dihedral(img, flips[0], flips[1], transpose)
+    msk = dihedral(msk, flips[0], flips[1], transpose)
+
+    # Translation by whole pixels
+    size = tf.cast(tf.shape(img)[1:3], tf.float32)
+    shift = tf.round(uniform(1, [batch_size, 2], -self.max_translate, self.max_translate) * size)
+    img = _translate(img, shift[:, 1], shift[:, 0], 'REFLECT')
+    msk = _translate(msk, shift[:, 1], shift[:, 0], 'CONSTANT')
+
+    # Color: stronger scaling of the red (first) band, which carries most of the false color signal
+    channels = tf.shape(img)[-1]
+    red = uniform(2, [batch_size, 1], 0.8, 1.2)
+    others = uniform(3, [batch_size, channels - 1], 0.9, 1.1)
+    scale = tf.concat([red, others], axis=1) * uniform(4, [batch_size, 1], 0.7, 1.3)
+    img = tf.clip_by_value(img * tf.reshape(scale, [batch_size, 1, 1, channels]), 0.0, 1.0)
+    return img, msk
 
 def color_augmentation(img):
   """
-  Applies color augmentations suitable for false color imagery.
-  Focuses on red channel scaling and color transformations.
+  Applies the color augmentation of BatchAugmenter to an image or a batch, with one
+  random draw for the whole input. Kept for existing callers; training uses BatchAugmenter.
   """
-  # Random red channel scaling (since it's false color)
-  red_scale = tf.random.uniform(shape=[], minval=0.8, maxval=1.2)
-  
-  # Split channels
-  r, g, b = tf.split(img, 3, axis=-1)
-  
-  # Apply red channel scaling
-  r = r * red_scale
-  
-  # Optional: Add slight random adjustments to other channels
-  g_scale = tf.random.uniform(shape=[], minval=0.9, maxval=1.1)
-  b_scale = tf.random.uniform(shape=[], minval=0.9, maxval=1.1)
-  g = g * g_scale
-  b = b * b_scale
-  
-  # Recombine channels
-  img = tf.concat([r, g, b], axis=-1)
-  
-  # Apply brightness adjustment
-  brightness_factor = tf.random.uniform(shape=[], minval=0.7, maxval=1.3)
-  img = img * brightness_factor
-  
-  # Ensure values stay in valid range
-  img = tf.clip_by_value(img, 0.0, 1.0)
-  
-  return img
+  channels = tf.shape(img)[-1]
+  red = tf.random.uniform([1], minval=0.8, maxval=1.2)
+  others = tf.random.uniform([channels - 1], minval=0.9, maxval=1.1)
+  scale = tf.concat([red, others], axis=0) * tf.random.uniform([], minval=0.7, maxval=1.3)
+  return tf.clip_by_value(img * scale, 0.0, 1.0)
 
-def augmentation(img, msk):
+def augmentation(img, msk, seed=(0, 0)):
   """
-  Applies random data augmentation to image and mask pairs for deep learning training.
-  This function performs several types of augmentations to increase dataset diversity:
-  1. Random horizontal and vertical flips (50% probability each)
-  2. Random 90-degree rotations (0°, 90°, 180°, or 270°)
-  3. Random translations (up to 10% of image dimensions)
-  4. Color augmentations for false color imagery
+  Applies random data augmentation to a batch of image and mask pairs.
+  See BatchAugmenter for the transformations.
   """
-  # Store original shape
-  original_shape = tf.shape(img)
-  original_height = original_shape[1]
-  original_width = original_shape[2]
-
-  # Independent random parameters
-  flip_lr = tf.random.uniform(shape=[], minval=0, maxval=1) > 0.5
-  flip_ud = tf.random.uniform(shape=[], minval=0, maxval=1) > 0.5
-  k = tf.random.uniform(shape=[], minval=0, maxval=4, dtype=tf.int32)  # 0-3 for 90° rotations
-  dx = tf.random.uniform(shape=[], minval=-0.1, maxval=0.1) * tf.cast(original_width, tf.float32)
-  dy = tf.random.uniform(shape=[], minval=-0.1, maxval=0.1) * tf.cast(original_height, tf.float32)
-
-  # Apply color augmentation
-  img = color_augmentation(img)
-
-  # Apply flips independently
-  img = tf.cond(flip_lr, lambda: tf.image.flip_left_right(img), lambda: img)
-  msk = tf.cond(flip_lr, lambda: tf.image.flip_left_right(msk), lambda: msk)
-  img = tf.cond(flip_ud, lambda: tf.image.flip_up_down(img), lambda: img)
-  msk = tf.cond(flip_ud, lambda: tf.image.flip_up_down(msk), lambda: msk)
-
-  # Rotate by 90° increments
-  img = tf.image.rot90(img, k=k)
-  msk = tf.image.rot90(msk, k=k)
-
-  # Translation via dynamic padding and cropping
-  pad_size = tf.cast(tf.maximum(tf.abs(dx), tf.abs(dy)) + 5, tf.int32)
-  dx_int = tf.cast(dx, tf.int32)
-  dy_int = tf.cast(dy, tf.int32)
-
-  # Pad - use CONSTANT for mask
-  img = tf.pad(img, [[0,0], [pad_size,pad_size], [pad_size,pad_size], [0,0]], mode='REFLECT')
-  msk = tf.pad(msk, [[0,0], [pad_size,pad_size], [pad_size,pad_size], [0,0]], mode='CONSTANT', constant_values=0)
-
-  # Crop
-  offset_height = pad_size + dy_int
-  offset_width = pad_size + dx_int
-  img = tf.image.crop_to_bounding_box(img, offset_height, offset_width, original_height, original_width)
-  msk = tf.image.crop_to_bounding_box(msk, offset_height, offset_width, original_height, original_width)
-
-  return img, msk
-
-def generate_multiple_augmentations(img, msk, num_versions=5):
+  return BatchAugmenter().augment(img, msk, tf.constant(seed, tf.int64))
+
+def generate_multiple_augmentations(img, msk, num_versions=5, seed=0):
   """
-  Generates multiple augmented versions of an image and mask pair.
+  Generates multiple augmented versions of an image and mask batch, stacked along a new first axis.
   """
-  augmented_images = []
-  augmented_masks = []
-  
-  for _ in range(num_versions):
-    aug_img, aug_msk = augmentation(img, msk)
-    augmented_images.append(aug_img)
-    augmented_masks.append(aug_msk)
-  
-  # Stack all augmented versions along the batch dimension
-  stacked_images = tf.stack(augmented_images, axis=0)
-  stacked_masks = tf.stack(augmented_masks, axis=0)
-  
-  return stacked_images, stacked_masks
+  augmenter = BatchAugmenter(seed=seed)
+  versions = [augmenter.augment(img, msk, tf.constant([seed, v], tf.int64)) for v in range(num_versions)]
+  return tf.stack([v[0] for v in versions], axis=0), tf.stack([v[1] for v in versions], axis=0)
 
 class aug(tf.keras.callbacks.Callback):
-  """Callback for data augmentation."""
+  """
+  Deprecated: Keras never called the batch hook of this callback, so it did not augment
+  anything. It is kept so existing training scripts still run; augment the dataset with
+  BatchAugmenter (DataSplitter(..., augmenter=...)) instead.
+  """
   def __init__(self, num_versions=5):
     super(aug, self).__init__()
     self.num_versions = num_versions
-    
-  def on_training_batch_begin(self, batch, logs=None):
-    # Apply multiple augmentations to each image in the batch
-    def augment_batch(x, y):
-      # Unbatch the dataset to process individual samples
-      aug_images, aug_masks = generate_multiple_augmentations(x, y, self.num_versions)
-      return aug_images, aug_masks
-    
-    # Apply augmentation to the batch
-    batch = batch.map(augment_batch, num_parallel_calls=5)
-    
-    # Flatten the batch to get all augmented versions
-    batch = batch.unbatch()
-    
-    # Shuffle the augmented samples
-    batch = batch.shuffle(10 * self.num_versions)
+    warnings.warn("augmentation.aug does not augment, use BatchAugmenter on the dataset instead",
+                  DeprecationWarning, stacklevel=2)
 
 def visualize_multiple_augmentations(image, mask, num_versions=5):
   """Visualize multiple augmented versions of an image and its mask."""
+  # Imported here so inference can use the transforms without matplotlib
+  import matplotlib.pyplot as plt
+
   # Generate multiple augmented versions
   aug_images, aug_masks = generate_multiple_augmentations(image, mask, num_versions)
   
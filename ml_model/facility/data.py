@@ -1,3 +1,5 @@
+import os
+import hashlib
 import tensorflow as tf
 
 class WellpadDataset:
@@ -7,7 +9,7 @@ class WellpadDataset:
         """The dataset is configured to work with RGB (Red, Green, Blue) satellite imagerybands"""
         self.bands = ['R','G','B']
 
-    def get(self, pattern):
+    def get(self, pattern, cache_dir=None):
         """
         Load and preprocess a dataset from TFRecord files.
         
@@ -18,6 +20,10 @@ class WellpadDataset:
         4. Converts the tensors into (image, mask) tuples
         5. Normalizes the images if needed
         6. Caches the dataset for improved performance
+        
+        Without cache_dir the decoded float32 examples are cached in memory. With cache_dir they
+        are cached on local disk in compact form instead (see __compact_cache), and the cache is
+        reused by later runs over the same files.
         """
         self.__describe_features()
         # Find all TFRecord files matching the pattern
@@ -31,10 +37,105 @@ class WellpadDataset:
         ds = ds.map(self.__resize, num_parallel_calls=5)
         
         # Cache the dataset to avoid reloading it on subsequent epochs
+        if cache_dir:
+            return self.__compact_cache(ds, cache_dir, f'examples-{self.__cache_key(glob)}')
         ds = ds.cache()
         
         return ds
     
+    def get_batched(self, pattern, batch_size=16, deterministic=True, cache=False, cache_dir=None):
+        """
+        Load a dataset from TFRecord files with a batch-first pipeline.
+        
+        Unlike get(), this method:
+        1. Reads the files in parallel by interleaving the shards
+        2. Batches the serialized records before parsing them
+        3. Parses, stacks and normalizes whole batches at once with parse_example
+        4. Lets tf.data tune the parallelism and prefetches the next batches
+        
+        The dataset yields batches of (image, mask); call unbatch() to get single examples.
+        Whether this is faster than get() depends on the cores available to tf.data: on one
+        core the dataset suite of ml_model.benchmark measured no gain, so get() stays the
+        default of the training workflow. With cache=True the parsed batches are cached in memory, with cache_dir in compact
+        form on local disk.
+        """
+        self.__describe_features()
+        files = tf.io.gfile.glob(pattern)
+        if not files:
+            raise FileNotFoundError(f"No TFRecord files match {pattern}")
+        
+        # Read the shards in parallel
+        ds = tf.data.Dataset.from_tensor_slices(files)
+        ds = ds.interleave(
+            lambda f: tf.data.TFRecordDataset(f, compression_type='GZIP'),
+            cycle_length=min(len(files), 8),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=deterministic)
+        
+        # Parse whole batches of serialized records at once
+        ds = ds.batch(batch_size)
+        ds = ds.map(self.__parse_batch, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+        
+        if cache_dir:
+            ds = self.__compact_cache(ds, cache_dir, f'batches-{batch_size}-{self.__cache_key(files)}')
+        elif cache:
+            ds = ds.cache()
+        
+        return ds.prefetch(tf.data.AUTOTUNE)
+    
+    def parse(self, records, batch_size=64, cache_dir=None, cache_name=None):
+        """
+        Parse a dataset of serialized examples, e.g. one side of a RecordManifest split, into
+        single (image, mask) examples using the batch-first parser of get_batched. With
+        cache_dir and cache_name the parsed batches are cached compactly on local disk.
+        """
+        self.__describe_features()
+        ds = records.batch(batch_size)
+        ds = ds.map(self.__parse_batch, num_parallel_calls=tf.data.AUTOTUNE)
+        if cache_dir and cache_name:
+            ds = self.__compact_cache(ds, cache_dir, f'{cache_name}-batches-{batch_size}')
+        return ds.unbatch()
+    
+    def __compact_cache(self, ds, cache_dir, name):
+        """
+        Cache the examples on local disk as uint8 instead of float32.
+        
+        Images are stored quantized to 256 levels and masks as 0/1 bytes, a quarter of the
+        size of the float32 examples, and converted back to float32 when they are read. The
+        name identifies the source files (a hash of their paths, sizes and modification times)
+        and the layout of the elements, so later runs over the same files read the cache from
+        the first epoch on, while a changed file set builds a new one.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        prefix = os.path.join(cache_dir, f'wellpad-{name}')
+        
+        # An interrupted run leaves a partial cache and a lockfile behind, start over
+        if not tf.io.gfile.exists(prefix + '.index'):
+            for leftover in tf.io.gfile.glob(prefix + '*'):
+                tf.io.gfile.remove(leftover)
+        
+        ds = ds.map(self.__to_compact, num_parallel_calls=tf.data.AUTOTUNE)
+        ds = ds.cache(prefix)
+        return ds.map(self.__from_compact, num_parallel_calls=tf.data.AUTOTUNE)
+    
+    def __cache_key(self, files):
+        """Hash of the paths, sizes and modification times of the source files."""
+        digest = hashlib.sha1()
+        for path in sorted(files):
+            stat = tf.io.gfile.stat(path)
+            digest.update(f'{path}|{stat.length}|{stat.mtime_nsec}\n'.encode('utf-8'))
+        return digest.hexdigest()[:16]
+    
+    def __to_compact(self, image, mask):
+        """Quantize a normalized image to uint8 and the mask to 0/1 bytes."""
+        image = tf.cast(tf.round(tf.clip_by_value(image, 0.0, 1.0) * 255.0), tf.uint8)
+        mask = tf.cast(mask > 0.5, tf.uint8)
+        return image, mask
+    
+    def __from_compact(self, image, mask):
+        """Convert a compact example back to float32."""
+        return tf.cast(image, tf.float32) / 255.0, tf.cast(mask, tf.float32)
+    
     def __describe_features(self):
         """Creates a dictionary mapping feature names to TensorFlow FixedLenFeature objects,
         which describe the shape and type of each feature in the input dataset."""
@@ -54,6 +155,21 @@ class WellpadDataset:
 """
         return tf.io.parse_single_example(ex, self.features)
 
+    def __parse_batch(self, serialized):
+        """Parse a batch of serialized examples into normalized (image, mask) batches."""
+        inputs = tf.io.parse_example(serialized, self.features)
+        
+        # Stack along the last axis: [batch, height, width, bands]
+        stacked = tf.stack([inputs[key] for key in self.featureNames], axis=-1)
+        image = stacked[..., :len(self.bands)]
+        mask = stacked[..., len(self.bands):]
+        
+        # Normalize every image by its own maximum if it exceeds 1
+        max_value = tf.reduce_max(image, axis=[1, 2, 3], keepdims=True)
+        image = image / tf.where(max_value > 1.0, max_value, tf.ones_like(max_value))
+        
+        return image, mask
+    
     def __to_tuple(self, inputs):
         """Convert parsed tensors to (image, mask) tuples."""
         inputsList = [inputs.get(key) for key in self.featureNames]
@@ -1,20 +1,71 @@
 import math
+import tensorflow as tf
 
 class DatasetSplitter:
     """Class for splitting a dataset into training and evaluation sets."""
     
-    def __init__(self, data, train_pct=0.7, batch_size=16, shuffle_buffer_size=10000):
-        """Initialize the DatasetSplitter with the given data and parameters."""
+    def __init__(self, data, train_pct=0.7, batch_size=16, shuffle_buffer_size=10000, augmenter=None):
+        """
+        Initialize the DatasetSplitter with the given data and parameters.
+        
+        An augmenter (e.g. a BatchAugmenter) is applied to the training batches as a pipeline stage.
+        """
         self.data = data
         self.train_pct = train_pct
         self.batch_size = batch_size
         self.shuffle_buffer_size = shuffle_buffer_size
+        self.augmenter = augmenter
         self.full_size = sum(1 for _ in data)
         self.split = int(self.full_size * self.train_pct)
         
         self._prepare_datasets()
         self._calculate_steps()
     
+    @classmethod
+    def from_manifest(cls, manifest, dataset, train_pct=0.7, batch_size=16, shuffle_buffer_size=10000,
+                      split_by='index', seed=0, cache_dir=None, augmenter=None, shuffle_seed=None):
+        """
+        Create the training and evaluation sets from a RecordManifest.
+        
+        The sizes come from the manifest, so nothing is read to count the records, and the
+        split is made on record indices (or whole files) before any shuffling, so the two sets
+        never overlap, however often the training set is reshuffled.
+        
+        With a shuffle_seed every process shuffles the training set in the same order, a new
+        one each epoch. Data-parallel workers need it: tf.data shards the batches by position
+        (AutoShardPolicy.DATA), so with different orders their slices would overlap.
+        """
+        splitter = cls.__new__(cls)
+        splitter.data = None
+        splitter.train_pct = train_pct
+        splitter.batch_size = batch_size
+        splitter.shuffle_buffer_size = shuffle_buffer_size
+        splitter.augmenter = augmenter
+        
+        training, evaluation, train_size, eval_size = manifest.split(train_pct, by=split_by, seed=seed)
+        splitter.full_size = train_size + eval_size
+        splitter.split = train_size
+        
+        # The caches are keyed by the shards each side reads, replaced or edited shards build new ones
+        train_shards, eval_shards = manifest.split_shards(train_pct, by=split_by, seed=seed)
+        cache_name = f'{split_by}-{seed}-{train_pct}'
+        splitter.training = dataset.parse(training, cache_dir=cache_dir,
+                                          cache_name=f'train-{cache_name}-{manifest.key(train_shards)}')
+        splitter.evaluation = dataset.parse(evaluation, cache_dir=cache_dir,
+                                            cache_name=f'eval-{cache_name}-{manifest.key(eval_shards)}')
+        
+        # Shuffle the training set only, after splitting
+        splitter.training = splitter.training.shuffle(
+            buffer_size=shuffle_buffer_size,
+            seed=shuffle_seed,
+            reshuffle_each_iteration=True
+        ).batch(batch_size).repeat()
+        splitter.training = splitter._augment(splitter.training)
+        splitter.evaluation = splitter.evaluation.batch(batch_size)
+        
+        splitter._calculate_steps()
+        return splitter
+    
     def _prepare_datasets(self):
         # Shuffle before splitting to ensure proper distribution
         shuffled_data = self.data.shuffle(
@@ -26,9 +77,15 @@ class DatasetSplitter:
         self.evaluation = shuffled_data.skip(self.split)
         
         # Batch after splitting
-        self.training = self.training.batch(self.batch_size).repeat()
+        self.training = self._augment(self.training.batch(self.batch_size).repeat())
         self.evaluation = self.evaluation.batch(self.batch_size)
     
+    def _augment(self, batches):
+        # Augment whole batches in parallel with training and keep the next ones ready
+        if self.augmenter is None:
+            return batches
+        return self.augmenter(batches).prefetch(tf.data.AUTOTUNE)
+    
     def _calculate_steps(self):
         self.TRAIN_STEPS = math.ceil(self.split / self.batch_size)
         self.EVAL_STEPS = math.ceil((self.full_size - self.split) / self.batch_size)
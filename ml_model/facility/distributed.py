@@ -0,0 +1,273 @@
+"""
+Data-parallel training of the UNet over several worker processes or machines.
+
+Every worker runs the same script. The workers find each other through the TF_CONFIG
+environment variable, which holds the addresses of all workers and the index of this one:
+
+    TF_CONFIG='{"cluster": {"worker": ["host1:12345", "host2:12345"]}, "task": {"type": "worker", "index": 0}}' \
+        python distributed.py "/data/wellpads/*.gz" --batch-size 16
+
+Worker 0 is the chief: only it writes the model checkpoint and the CSV metrics. To try it out
+on one machine, start N local workers on free ports:
+
+    python distributed.py "/data/wellpads/*.gz" --local-workers 2
+"""
+import os
+import sys
+import json
+import socket
+import shutil
+import tempfile
+import argparse
+import subprocess
+from datetime import date
+import tensorflow as tf
+from keras.callbacks import ModelCheckpoint, EarlyStopping, CSVLogger
+from data import WellpadDataset
+from datasplitter import DatasetSplitter
+from manifest import RecordManifest
+from augmentation import BatchAugmenter
+from unet import UNet
+
+class DistributedTrainer:
+    """
+    Trains a UNet with a MultiWorkerMirroredStrategy.
+
+    The model is built inside the strategy scope so its variables are mirrored on every worker
+    and the gradients are all-reduced after each step. Batch sizes are given per worker; the
+    input pipeline is built with the global batch size and tf.data splits every global batch
+    between the workers (auto-sharding), so each worker processes a different slice of it.
+    The slices are taken by position, so every worker must build the batches in the same
+    order: the training set is shuffled with a seed shared by the workers (see train).
+    """
+
+    def __init__(self, shard_policy=tf.data.experimental.AutoShardPolicy.DATA):
+        self.strategy = tf.distribute.MultiWorkerMirroredStrategy()
+        self.shard_policy = shard_policy
+        resolver = self.strategy.cluster_resolver
+        self.task_type = resolver.task_type if resolver else None
+        self.task_id = resolver.task_id if resolver else 0
+
+    @property
+    def num_workers(self):
+        return self.strategy.num_replicas_in_sync
+
+    @property
+    def is_chief(self):
+        """Worker 0 (or the only process when TF_CONFIG is not set) is the chief."""
+        return self.task_type in (None, 'chief') or (self.task_type == 'worker' and self.task_id == 0)
+
+    def global_batch_size(self, batch_size):
+        return batch_size * self.num_workers
+
+    def build_model(self, **unet_kwargs):
+        """Build and compile a UNet with mirrored variables."""
+        with self.strategy.scope():
+            return UNet(**unet_kwargs)
+
+    def fit(self, unet, training, evaluation, epochs, steps_per_epoch, validation_steps, callbacks=(), verbose=True):
+        """
+        Custom training loop over the sharded datasets.
+
+        Every worker runs the step on its slice of the global batch; the loss is divided by the
+        number of replicas so the all-reduced (summed) gradients are those of the global mean.
+        The logs ('loss', 'dice_loss' and their 'val_' counterparts) are averaged over the workers
+        before they reach the Keras callbacks, so all workers take the same decisions (early
+        stopping, best checkpoint). Keras' own fit() cannot be used here: it fails to reduce
+        its logs across several workers.
+        """
+        model = unet.model
+        with self.strategy.scope():
+            model.optimizer.build(model.trainable_variables)
+        train_iterator = iter(self.strategy.experimental_distribute_dataset(self.shard(training)))
+        eval_dataset = self.strategy.experimental_distribute_dataset(self.shard(evaluation))
+        train_step, eval_step = self.__steps(unet)
+
+        callbacks = tf.keras.callbacks.CallbackList(list(callbacks), model=model)
+        history = tf.keras.callbacks.History()
+        history.set_model(model)
+        model.stop_training = False
+        callbacks.on_train_begin()
+        history.on_train_begin()
+        for epoch in range(epochs):
+            callbacks.on_epoch_begin(epoch)
+            logs = self.__average([train_step(train_iterator) for _ in range(steps_per_epoch)])
+            eval_iterator = iter(eval_dataset)
+            val_logs = self.__average([eval_step(eval_iterator) for _ in range(validation_steps)])
+            logs.update({f'val_{name}': value for name, value in val_logs.items()})
+            callbacks.on_epoch_end(epoch, logs)
+            history.on_epoch_end(epoch, logs)
+            if verbose:
+                print(f'Epoch {epoch + 1}/{epochs} ' + ' '.join(f'{k}: {v:.4f}' for k, v in logs.items()))
+            if model.stop_training:
+                break
+        callbacks.on_train_end()
+        return history
+
+    def __steps(self, unet):
+        model = unet.model
+        optimizer = model.optimizer
+        strategy = self.strategy
+        num_replicas = strategy.num_replicas_in_sync
+
+        def replica_train_step(x, y):
+            with tf.GradientTape() as tape:
+                y_pred = model(x, training=True)
+                loss = tf.reduce_mean(unet.bce_dice_loss(y, y_pred))
+                scaled_loss = loss / num_replicas
+                if hasattr(optimizer, 'scale_loss'):
+                    scaled_loss = optimizer.scale_loss(scaled_loss)
+            gradients = tape.gradient(scaled_loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+            return {'loss': loss, 'dice_loss': unet.dice_loss(y, y_pred)}
+
+        def replica_eval_step(x, y):
+            y_pred = model(x, training=False)
+            return {'loss': tf.reduce_mean(unet.bce_dice_loss(y, y_pred)), 'dice_loss': unet.dice_loss(y, y_pred)}
+
+        @tf.function
+        def train_step(iterator):
+            logs = strategy.run(replica_train_step, args=next(iterator))
+            return {name: strategy.reduce('MEAN', value, axis=None) for name, value in logs.items()}
+
+        @tf.function
+        def eval_step(iterator):
+            logs = strategy.run(replica_eval_step, args=next(iterator))
+            return {name: strategy.reduce('MEAN', value, axis=None) for name, value in logs.items()}
+
+        return train_step, eval_step
+
+    @staticmethod
+    def __average(step_logs):
+        return {name: float(sum(float(logs[name]) for logs in step_logs) / len(step_logs)) for name in step_logs[0]}
+
+    def shard(self, ds):
+        """Let tf.data split the dataset between the workers."""
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = self.shard_policy
+        return ds.with_options(options)
+
+    def callbacks(self, result_dir, name, patience=30):
+        """
+        Checkpoint, CSV and early stopping callbacks.
+
+        Saving a mirrored model takes part in collective operations, so every worker saves the
+        checkpoint, but only the chief writes to result_dir; the others write to a temporary
+        directory that is removed after training (see cleanup). Only the chief logs to CSV.
+        """
+        save_dir = result_dir if self.is_chief else self.__scratch_dir()
+        callbacks = [
+            ModelCheckpoint(
+                filepath=os.path.join(save_dir, f'{name}_wellpad_model_.keras'),
+                monitor='val_loss',
+                mode='min',
+                save_best_only=True),
+            EarlyStopping(
+                monitor='val_loss',
+                patience=patience,
+                restore_best_weights=True)
+        ]
+        if self.is_chief:
+            callbacks.append(CSVLogger(os.path.join(result_dir, f'{name}_metrics.csv'), separator=',', append=False))
+        return callbacks
+
+    def cleanup(self):
+        """Remove the checkpoints written by a non-chief worker."""
+        if not self.is_chief:
+            shutil.rmtree(self.__scratch_dir(), ignore_errors=True)
+
+    def __scratch_dir(self):
+        return os.path.join(tempfile.gettempdir(), f'wellpad-worker-{self.task_id}')
+
+def train(pattern, result_dir, cache_dir, batch_size=16, epochs=100, precision='float32', num_filters=None,
+          augment=True, seed=42):
+    """Train on the TFRecord files matching pattern as one worker of the cluster in TF_CONFIG."""
+    trainer = DistributedTrainer()
+    global_batch_size = trainer.global_batch_size(batch_size)
+    if trainer.is_chief:
+        os.makedirs(result_dir, exist_ok=True)
+        print(f'Training on {trainer.num_workers} workers, global batch size {global_batch_size}')
+
+    # Every worker keeps its own manifest and cache, they may share a file system
+    worker_cache = os.path.join(cache_dir, f'worker-{trainer.task_id}')
+    manifest = RecordManifest.build(pattern, os.path.join(worker_cache, 'manifest.json'))
+    splitter = DatasetSplitter.from_manifest(
+        manifest, WellpadDataset(), batch_size=global_batch_size, seed=0, cache_dir=worker_cache,
+        augmenter=BatchAugmenter(seed=seed) if augment else None, shuffle_seed=seed)
+    if trainer.is_chief:
+        splitter.summary()
+
+    unet_kwargs = {'precision': precision}
+    if num_filters:
+        unet_kwargs['num_filters'] = num_filters
+    unet = trainer.build_model(**unet_kwargs)
+
+    history = trainer.fit(
+        unet,
+        splitter.training,
+        splitter.evaluation,
+        epochs=epochs,
+        steps_per_epoch=splitter.TRAIN_STEPS,
+        validation_steps=splitter.EVAL_STEPS,
+        callbacks=trainer.callbacks(result_dir, str(date.today())),
+        verbose=trainer.is_chief)
+    trainer.cleanup()
+    return history
+
+def free_ports(count):
+    sockets = []
+    for _ in range(count):
+        s = socket.socket()
+        s.bind(('localhost', 0))
+        sockets.append(s)
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+def launch_local(num_workers, argv):
+    """Run this script as num_workers local processes forming one cluster; returns the exit code."""
+    workers = [f'localhost:{port}' for port in free_ports(num_workers)]
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env['TF_CONFIG'] = json.dumps({'cluster': {'worker': workers}, 'task': {'type': 'worker', 'index': index}})
+        processes.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)] + argv, env=env))
+    codes = [process.wait() for process in processes]
+    return max(codes, key=abs)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pattern', help='TFRecord files (glob pattern)')
+    parser.add_argument('--batch-size', type=int, default=16, help='Batch size per worker')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--precision', default='float32', choices=UNet.PRECISIONS)
+    parser.add_argument('--filters', default=None, help='Comma separated UNet filter sizes, e.g. 16,32,64,128,256')
+    parser.add_argument('--no-augment', action='store_true')
+    parser.add_argument('--result-dir', default=None)
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--local-workers', type=int, default=0,
+                        help='Start this many local worker processes (ignored when TF_CONFIG is set)')
+    args = parser.parse_args(argv)
+
+    if args.local_workers > 0 and 'TF_CONFIG' not in os.environ:
+        worker_argv = [a for i, a in enumerate(argv)
+                       if a != '--local-workers' and not a.startswith('--local-workers=')
+                       and not (i > 0 and argv[i - 1] == '--local-workers')]
+        return launch_local(args.local_workers, worker_argv)
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    train(
+        args.pattern,
+        result_dir=args.result_dir or os.path.join(base_dir, 'results'),
+        cache_dir=args.cache_dir or os.path.join(base_dir, 'cache'),
+        batch_size=args.batch_size,
+        epochs=args.epochs,
+        precision=args.precision,
+        num_filters=[int(f) for f in args.filters.split(',')] if args.filters else None,
+        augment=not args.no_augment)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import random
+import numpy as np
+import tensorflow as tf
+
+# Records are assigned to the training set by hashing their global index into this many buckets
+SPLIT_BUCKETS = 10000
+
+class RecordManifest:
+    """
+    Persisted record counts and offsets of a set of TFRecord shards.
+
+    The manifest lists every shard with its size, modification time, number of records and the
+    global index of its first record. It is stored as JSON next to the data and updated
+    incrementally: only new or changed shards are counted again. It gives the dataset size
+    without reading the data and drives deterministic train/evaluation splits.
+    """
+
+    def __init__(self, path, compression_type='GZIP'):
+        self.path = path
+        self.compression_type = compression_type
+        self.shards = []
+        if tf.io.gfile.exists(path):
+            with tf.io.gfile.GFile(path, 'r') as f:
+                self.shards = json.load(f)['shards']
+
+    @classmethod
+    def build(cls, pattern, path, compression_type='GZIP'):
+        """Load the manifest at path, bring it up to date with the files matching pattern and save it."""
+        manifest = cls(path, compression_type)
+        manifest.update(tf.io.gfile.glob(pattern))
+        return manifest
+
+    @property
+    def total(self):
+        """Total number of records."""
+        return sum(shard['count'] for shard in self.shards)
+
+    @property
+    def files(self):
+        return [shard['path'] for shard in self.shards]
+
+    def update(self, files):
+        """Count the records of new or changed shards, drop removed ones, recompute offsets and save."""
+        known = {shard['path']: shard for shard in self.shards}
+        shards = []
+        counted = 0
+        for path in sorted(files):
+            stat = tf.io.gfile.stat(path)
+            shard = known.get(path)
+            if shard is None or shard['size'] != stat.length or shard['mtime_nsec'] != stat.mtime_nsec:
+                shard = {
+                    'path': path,
+                    'size': stat.length,
+                    'mtime_nsec': stat.mtime_nsec,
+                    'count': self.__count_records(path)
+                }
+                counted += 1
+            shards.append(dict(shard))
+
+        offset = 0
+        for shard in shards:
+            shard['offset'] = offset
+            offset += shard['count']
+        self.shards = shards
+        self.save()
+        print(f'Manifest: {len(shards)} shards, {offset} records ({counted} shards counted)')
+        return self
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            tf.io.gfile.makedirs(directory)
+        tmp_path = self.path + '.tmp'
+        with tf.io.gfile.GFile(tmp_path, 'w') as f:
+            json.dump({'shards': self.shards}, f, indent=1)
+        tf.io.gfile.rename(tmp_path, self.path, overwrite=True)
+
+    def split(self, train_pct=0.7, by='index', seed=0):
+        """
+        Split the records into a training and an evaluation set that never overlap.
+
+        by='index' assigns every record by a hash of its global index and the seed, so the
+        assignment does not depend on the order in which records are read or shuffled.
+        by='file' assigns whole shards, see split_shards.
+
+        Returns:
+            tuple: (training records, evaluation records, training size, evaluation size), the
+                records being datasets of serialized examples.
+        Raises:
+            ValueError: One of the sets would be empty.
+        """
+        train_shards, eval_shards = self.split_shards(train_pct, by, seed)
+        if by == 'file':
+            training = self.__indexed_records(train_shards).map(lambda _, record: record)
+            evaluation = self.__indexed_records(eval_shards).map(lambda _, record: record)
+            train_size = sum(shard['count'] for shard in train_shards)
+        else:
+            limit = int(round(train_pct * SPLIT_BUCKETS))
+            train_size = int(np.count_nonzero(self.__bucket(np.arange(self.total, dtype=np.int64), seed) < limit))
+
+            bucket = self.__bucket
+            records = self.__indexed_records(self.shards)
+            training = records.filter(lambda i, _: bucket(i, seed) < limit).map(lambda _, record: record)
+            evaluation = records.filter(lambda i, _: bucket(i, seed) >= limit).map(lambda _, record: record)
+
+        eval_size = self.total - train_size
+        if train_size == 0 or eval_size == 0:
+            raise ValueError(f"Splitting {self.total} records by {by} at train_pct={train_pct} leaves "
+                             f"{train_size} training and {eval_size} evaluation records")
+        return training, evaluation, train_size, eval_size
+
+    def split_shards(self, train_pct=0.7, by='index', seed=0):
+        """
+        The shards read by the training and the evaluation set.
+
+        by='index' reads every shard on both sides. by='file' takes the shards in a seeded
+        random order and adds each one to the training set when that brings it closer to
+        train_pct of the records, the others go to the evaluation set, which always keeps at
+        least one shard.
+
+        Returns:
+            tuple: (training shards, evaluation shards)
+        """
+        if by == 'index':
+            return list(self.shards), list(self.shards)
+        if by != 'file':
+            raise ValueError(f"Unknown split '{by}', expected 'index' or 'file'")
+        if len(self.shards) < 2:
+            raise ValueError(f"Splitting by file needs at least 2 shards, got {len(self.shards)}")
+
+        shards = list(self.shards)
+        random.Random(seed).shuffle(shards)
+        target = train_pct * self.total
+        train_shards, eval_shards, train_size = [], [], 0
+        for shard in shards:
+            if abs(train_size + shard['count'] - target) < abs(train_size - target):
+                train_shards.append(shard)
+                train_size += shard['count']
+            else:
+                eval_shards.append(shard)
+        if not eval_shards:
+            # Give up the smallest training shard rather than evaluating on nothing
+            smallest = min(train_shards, key=lambda shard: shard['count'])
+            train_shards.remove(smallest)
+            eval_shards.append(smallest)
+        if not train_shards:
+            raise ValueError(f"No shard fits in a training set of {train_pct:.0%} of {self.total} records, "
+                             f"split by index or use smaller shards")
+        return train_shards, eval_shards
+
+    @staticmethod
+    def key(shards):
+        """Hash of the paths, sizes and modification times of shards, identifies their content."""
+        digest = hashlib.sha1()
+        for shard in sorted(shards, key=lambda shard: shard['path']):
+            digest.update(f"{shard['path']}|{shard['size']}|{shard['mtime_nsec']}\n".encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def __indexed_records(self, shards):
+        """(global index, serialized record) pairs of the given shards, read in parallel."""
+        paths = [shard['path'] for shard in shards]
+        offsets = np.array([shard['offset'] for shard in shards], dtype=np.int64)
+        ds = tf.data.Dataset.from_tensor_slices((tf.constant(paths, dtype=tf.string), offsets))
+        return ds.interleave(
+            lambda path, offset: tf.data.TFRecordDataset(path, compression_type=self.compression_type).enumerate(start=offset),
+            cycle_length=max(1, min(len(paths), 8)),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            deterministic=True)
+
+    @staticmethod
+    def __bucket(index, seed):
+        """Multiplicative hash of a record index into [0, SPLIT_BUCKETS), for NumPy arrays and tensors alike."""
+        return ((index + seed) * 2654435761 % 4294967296) % SPLIT_BUCKETS
+
+    def __count_records(self, path):
+        ds = tf.data.TFRecordDataset(path, compression_type=self.compression_type)
+        return int(ds.reduce(np.int64(0), lambda count, _: count + 1))
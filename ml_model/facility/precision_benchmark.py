@@ -0,0 +1,104 @@
+"""
+Compares training step time and final dice of the UNet training modes.
+
+Every configuration trains a freshly initialized UNet with the same seed on the same split
+and reports the median step time (after the first epoch, which includes tracing and XLA
+compilation) and the evaluation dice after the last epoch.
+
+    python precision_benchmark.py "/data/wellpads/*.gz" --epochs 5 --batch-size 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from data import WellpadDataset
+from datasplitter import DatasetSplitter
+from manifest import RecordManifest
+from unet import UNet
+
+# (precision, jit_compile); the first one is the reference configuration
+CONFIGURATIONS = [
+    ('float32', False),
+    ('float32', True),
+    ('mixed_bfloat16', False),
+    ('mixed_bfloat16', True),
+    ('mixed_float16', True),
+]
+
+class StepTimer(tf.keras.callbacks.Callback):
+    """Records the duration of every training step."""
+    def on_train_begin(self, logs=None):
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epochs.append([])
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.epochs[-1].append(time.perf_counter() - self.start)
+
+def benchmark(splitter, precision, jit_compile, epochs, seed=0):
+    tf.keras.utils.set_random_seed(seed)
+    unet = UNet(precision=precision, jit_compile=jit_compile)
+    timer = StepTimer()
+    history = unet.model.fit(
+        x=splitter.training,
+        epochs=epochs,
+        steps_per_epoch=splitter.TRAIN_STEPS,
+        validation_data=splitter.evaluation,
+        validation_steps=splitter.EVAL_STEPS,
+        callbacks=[timer],
+        verbose=0)
+    # Skip the first epoch: it includes tracing and compilation
+    steps = [t for epoch in timer.epochs[1:] for t in epoch] or timer.epochs[0]
+    return {
+        'precision': precision,
+        'jit_compile': jit_compile,
+        'step_ms': round(1000 * float(np.median(steps)), 2),
+        'first_epoch_s': round(float(sum(timer.epochs[0])), 2),
+        'eval_dice': round(1.0 - float(history.history['val_dice_loss'][-1]), 4)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pattern', help='TFRecord files (glob pattern)')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--cache-dir', default=None, help='Directory for the manifest and the dataset cache')
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache')
+    manifest = RecordManifest.build(args.pattern, os.path.join(cache_dir, 'manifest.json'))
+    splitter = DatasetSplitter.from_manifest(manifest, WellpadDataset(), batch_size=args.batch_size, cache_dir=cache_dir)
+    splitter.summary()
+
+    results = []
+    for precision, jit_compile in CONFIGURATIONS:
+        try:
+            result = benchmark(splitter, precision, jit_compile, args.epochs)
+        except Exception as e:
+            # e.g. float16 kernels or XLA not available on this device
+            print(f'{precision} (jit_compile={jit_compile}) failed: {e}', file=sys.stderr)
+            continue
+        results.append(result)
+        print(f"{precision:>15} jit={str(jit_compile):5} step {result['step_ms']:8.2f} ms  "
+              f"dice {result['eval_dice']:.4f}  first epoch {result['first_epoch_s']:.1f} s")
+
+    if results:
+        reference = results[0]
+        for result in results:
+            result['speedup'] = round(reference['step_ms'] / result['step_ms'], 3)
+            result['dice_change'] = round(result['eval_dice'] - reference['eval_dice'], 4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -15,35 +15,82 @@ class UNet:
     1. Encoder path (downsampling): Extracts features through repeated convolution and pooling
     2. Bottleneck: Processes the most abstract features
     3. Decoder path (upsampling): Reconstructs the image using transposed convolutions and skip connections
+    
+    Training mode:
+    - precision: 'float32', 'mixed_bfloat16' (fast on CPUs and TPUs) or 'mixed_float16' (GPUs, with
+      dynamic loss scaling). With mixed precision the layers compute in reduced precision and keep
+      float32 weights; the sigmoid output and the losses stay in float32.
+    - jit_compile: compile the training and prediction steps with XLA.
     """
-    def __init__(self, input_shape=(256, 256, 3), num_filters=[16, 32, 64, 128, 256]):
+    PRECISIONS = ('float32', 'mixed_bfloat16', 'mixed_float16')
+    CONVOLUTIONS = ('standard', 'separable')
+    
+    def __init__(self, input_shape=(256, 256, 3), num_filters=[16, 32, 64, 128, 256], precision='float32',
+                 jit_compile=False, conv='standard', depth=None, width_multiplier=1.0, dropout=0.15):
+        """
+        Architecture options for lighter models, e.g. for serving on CPUs:
+        - conv: 'standard' 3x3 convolutions or depthwise-'separable' ones, several times cheaper.
+        - depth: number of downsampling levels, at most len(num_filters) - 1 (the default). The
+          bottleneck uses the filters of the level below the last one.
+        - width_multiplier: scales the number of filters of every level.
+        - dropout: dropout rate after every convolution, 0 disables it.
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {self.PRECISIONS}")
+        if conv not in self.CONVOLUTIONS:
+            raise ValueError(f"Unknown convolution '{conv}', expected one of {self.CONVOLUTIONS}")
+        depth = len(num_filters) - 1 if depth is None else depth
+        if not 1 <= depth < len(num_filters):
+            raise ValueError(f"Depth must be between 1 and {len(num_filters) - 1}, got {depth}")
         self.input_shape = input_shape
         self.num_filters = num_filters
+        self.precision = precision
+        self.jit_compile = jit_compile
+        self.conv = conv
+        self.depth = depth
+        self.width_multiplier = width_multiplier
+        self.dropout = dropout
         self.model = self.build_unet()
     
+    @property
+    def level_filters(self):
+        """Filters of the encoder levels followed by those of the bottleneck."""
+        return [max(4, int(round(f * self.width_multiplier))) for f in self.num_filters[:self.depth + 1]]
+    
+    def __conv(self, input_tensor, num_filters, padding='same', activation=None):
+        """3x3 convolution, standard or depthwise-separable"""
+        if self.conv == 'separable':
+            return layers.SeparableConv2D(filters=num_filters, kernel_size=(3,3), strides=1, padding=padding,
+                                          activation=activation)(input_tensor)
+        return layers.Conv2D(filters=num_filters, kernel_size=(3,3), strides=1, padding=padding,
+                             activation=activation)(input_tensor)
+    
+    def __dropout(self, input_tensor):
+        return layers.Dropout(self.dropout)(input_tensor) if self.dropout > 0 else input_tensor
+    
     def __downward_conv(self, input_tensor, num_filters, activation='relu', padding='same'):
         """Downward convolution block"""
-        down = layers.Conv2D(filters=num_filters, kernel_size=(3,3), strides=1, padding=padding)(input_tensor)
+        down = self.__conv(input_tensor, num_filters, padding=padding)
         down = layers.BatchNormalization()(down)
         down = layers.Activation(activation)(down)
-        down = layers.Dropout(0.15)(down)
-        down = layers.Conv2D(filters=num_filters, kernel_size=(3,3), strides=1, padding=padding)(down)
+        down = self.__dropout(down)
+        down = self.__conv(down, num_filters, padding=padding)
         down = layers.BatchNormalization()(down)
         down = layers.Activation(activation)(down)
-        down = layers.Dropout(0.15)(down)
+        down = self.__dropout(down)
         pool = layers.MaxPool2D(pool_size=(2,2), strides=(2,2))(down)
         return down, pool
     
     def __bottleneck(self, input_tensor, num_filters, activation='relu', padding='same'):
         """Bottleneck block"""
-        mid = layers.Conv2D(filters=num_filters, kernel_size=(3,3), strides=1, padding=padding)(input_tensor)
+        mid = self.__conv(input_tensor, num_filters, padding=padding)
         mid = layers.BatchNormalization()(mid)
         mid = layers.Activation(activation)(mid)
-        mid = layers.Dropout(0.15)(mid)
-        mid = layers.Conv2D(filters=num_filters, kernel_size=(3,3), strides=1, activation=activation, padding=padding)(mid)
+        mid = self.__dropout(mid)
+        mid = self.__conv(mid, num_filters, padding=padding, activation=activation)
         mid = layers.BatchNormalization()(mid)
         mid = layers.Activation(activation)(mid)
-        mid = layers.Dropout(0.15)(mid)
+        mid = self.__dropout(mid)
         return mid
     
     def __upward_conv(self, input_tensor, corresponding_down_tensor, num_filters, activation='relu', padding='same'):
@@ -52,47 +99,66 @@ class UNet:
         up = layers.concatenate([corresponding_down_tensor, up], axis=-1)
         up = layers.BatchNormalization()(up)
         up = layers.Activation(activation)(up)
-        up = layers.Conv2D(filters=num_filters, kernel_size=(3,3), strides=1, padding=padding)(up)
+        up = self.__conv(up, num_filters, padding=padding)
         up = layers.BatchNormalization()(up)
         up = layers.Activation(activation)(up)
-        up = layers.Dropout(0.15)(up)
-        up = layers.Conv2D(filters=num_filters, kernel_size=(3,3), strides=1, padding=padding)(up)
+        up = self.__dropout(up)
+        up = self.__conv(up, num_filters, padding=padding)
         up = layers.BatchNormalization()(up)
         up = layers.Activation(activation)(up)
-        up = layers.Dropout(0.15)(up)
+        up = self.__dropout(up)
         return up
     
     def build_unet(self):
         """" Build the U-Net model"""
-        inputs = layers.Input(shape=self.input_shape)
-        down1, pool1 = self.__downward_conv(inputs, self.num_filters[0])
-        down2, pool2 = self.__downward_conv(pool1, self.num_filters[1])
-        down3, pool3 = self.__downward_conv(pool2, self.num_filters[2])
-        down4, pool4 = self.__downward_conv(pool3, self.num_filters[3])
-        
-        middle = self.__bottleneck(pool4, self.num_filters[4])
-        
-        up1 = self.__upward_conv(middle, down4, self.num_filters[3])
-        up2 = self.__upward_conv(up1, down3, self.num_filters[2])
-        up3 = self.__upward_conv(up2, down2, self.num_filters[1])
-        up4 = self.__upward_conv(up3, down1, self.num_filters[0])
+        # The policy only applies to the layers created here, the previous one is restored afterwards
+        previous_policy = tf.keras.mixed_precision.global_policy()
+        tf.keras.mixed_precision.set_global_policy(self.precision)
+        try:
+            model = self.__build_layers()
+        finally:
+            tf.keras.mixed_precision.set_global_policy(previous_policy)
         
-        output = layers.Conv2D(filters=1, kernel_size=(1,1), activation='sigmoid', padding='same')(up4)
-        
-        model = models.Model(inputs=inputs, outputs=output)
+        optimizer = tf.keras.optimizers.Adam()
+        if self.precision == 'mixed_float16':
+            # float16 gradients underflow without loss scaling, bfloat16 has the range of float32
+            optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
         
         model.compile(
-            optimizer='adam',
+            optimizer=optimizer,
             loss=self.bce_dice_loss,
-            metrics=[self.dice_loss])
+            metrics=[self.dice_loss],
+            jit_compile=self.jit_compile)
         
         return model
     
+    def __build_layers(self):
+        filters = self.level_filters
+        inputs = layers.Input(shape=self.input_shape)
+        
+        # Encoder, keeping the output of every level for the skip connections
+        skips = []
+        x = inputs
+        for num_filters in filters[:-1]:
+            down, x = self.__downward_conv(x, num_filters)
+            skips.append(down)
+        
+        x = self.__bottleneck(x, filters[-1])
+        
+        # Decoder, from the deepest level up
+        for num_filters, skip in zip(reversed(filters[:-1]), reversed(skips)):
+            x = self.__upward_conv(x, skip, num_filters)
+        
+        # Output in float32 so the sigmoid does not saturate in reduced precision
+        output = layers.Conv2D(filters=1, kernel_size=(1,1), activation='sigmoid', padding='same', dtype='float32')(x)
+        
+        return models.Model(inputs=inputs, outputs=output)
+    
     @staticmethod
     def dice_coeff(y_true, y_pred):
         smooth = 1.0
-        y_true_f = tf.reshape(y_true, [-1])
-        y_pred_f = tf.reshape(y_pred, [-1])
+        y_true_f = tf.reshape(tf.cast(y_true, tf.float32), [-1])
+        y_pred_f = tf.reshape(tf.cast(y_pred, tf.float32), [-1])
         intersection = tf.reduce_sum(y_true_f * y_pred_f)
         return (2. * intersection + smooth) / (tf.reduce_sum(y_true_f) + tf.reduce_sum(y_pred_f) + smooth)
     
@@ -102,6 +168,8 @@ class UNet:
     
     @staticmethod
     def bce_dice_loss(y_true, y_pred):
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.cast(y_pred, tf.float32)
         return losses.binary_crossentropy(y_true, y_pred) + UNet.dice_loss(y_true, y_pred)
     
     def summary(self):
@@ -1,6 +1,7 @@
 import matplotlib.pyplot as plt
 import tensorflow as tf
 import os
+import time
 
 def show_image(image, mask):
   """Visualize a member of dataset"""
@@ -68,4 +69,33 @@ def plot_training_metrics(history, model_epochs, save_dir=None):
   plt.savefig(loss_path, dpi=300, bbox_inches='tight')
   plt.close()
 
-  return metrics_path, loss_path
\ No newline at end of file
+  return metrics_path, loss_path
+
+def measure_throughput(dataset, num_batches=50):
+  """
+  Iterate over a dataset and report the examples per second it delivers.
+  
+  Args:
+    dataset: Dataset yielding (image, mask) batches
+    num_batches: Number of batches to time (after one warm-up batch)
+  
+  Returns:
+    Examples per second
+  """
+  iterator = iter(dataset)
+  # The first batch includes the pipeline start-up
+  next(iterator)
+  
+  examples = 0
+  start = time.perf_counter()
+  for _ in range(num_batches):
+    try:
+      image, _ = next(iterator)
+    except StopIteration:
+      break
+    examples += int(tf.shape(image)[0])
+  elapsed = time.perf_counter() - start
+  
+  throughput = examples / elapsed if elapsed > 0 else 0.0
+  print(f'Input pipeline: {examples} examples in {elapsed:.2f}s ({throughput:.1f} examples/sec)')
+  return throughput
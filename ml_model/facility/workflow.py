@@ -1,10 +1,11 @@
 import os
 from data import WellpadDataset
-from utilities import show_image, plot_training_metrics
+from utilities import show_image, plot_training_metrics, measure_throughput
 from datasplitter import DatasetSplitter
+from manifest import RecordManifest
 from unet import UNet
 from datetime import date
-from augmentation import aug, visualize_multiple_augmentations
+from augmentation import BatchAugmenter, visualize_multiple_augmentations
 from keras.callbacks import ModelCheckpoint, EarlyStopping, CSVLogger
 
 # Today's date.
@@ -19,8 +20,16 @@ os.makedirs(dir_result, exist_ok=True)
 
 files = os.listdir(dir) 
 files = [f'{dir}/{fn}' for fn in files]
-data = WellpadDataset().get(files).shuffle(5000)
-splitter = DatasetSplitter(data)
+dir_cache = os.path.join(base_dir, 'cache')
+# get() was as fast as get_batched() in the dataset suite of ml_model.benchmark (one CPU core)
+measure_throughput(WellpadDataset().get(files).batch(64), num_batches=20)
+
+# Record counts per shard, only new or changed shards are counted
+manifest = RecordManifest.build(files, os.path.join(dir_cache, 'manifest.json'))
+# Deterministic split on record indices, each side cached compactly on local disk
+# Training batches are augmented on the fly, reproducibly for a given seed
+splitter = DatasetSplitter.from_manifest(manifest, WellpadDataset(), cache_dir=dir_cache,
+                                         augmenter=BatchAugmenter(num_versions=1, seed=42))
 splitter.summary()
 
 # Create the model
@@ -65,6 +74,6 @@ history = unet.model.fit(
     steps_per_epoch = splitter.TRAIN_STEPS,
     validation_data = splitter.evaluation,
     validation_steps = splitter.EVAL_STEPS,
-    callbacks = [aug(),model_checkpoint, csv_logger, early_stopping])
+    callbacks = [model_checkpoint, csv_logger, early_stopping])
 
 plot_training_metrics(history, model_epochs, save_dir=dir_result)
\ No newline at end of file
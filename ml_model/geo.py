@@ -0,0 +1,345 @@
+"""
+Wellpad detection on large georeferenced rasters (GeoTIFF or any other format GDAL reads).
+
+The scene is never loaded as a whole: it is processed in chunks of chunk_size x chunk_size
+pixels, each read on its own window (GDAL only reads the blocks the window touches) together
+with a margin of context on every side, predicted with the tiled inference of detect.py and
+written straight to a tiled, compressed GeoTIFF mask with the georeferencing of the source.
+Wellpads that cross chunk borders are merged, and the detections are written as GeoJSON in
+map coordinates. Run from the repository root:
+
+    python -m ml_model.geo scene.tif -o results/scene --chunk-size 2048 --overlap 32
+
+rasterio is optional and only needed for this module: pip install -r requirements-geo.txt
+"""
+import sys
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from ml_model.detect import predict_tiled, predict_batch, load_image
+from ml_model.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+def _rasterio():
+    """Import rasterio on first use, it is an optional dependency."""
+    try:
+        import rasterio
+        import rasterio.features
+        import rasterio.warp
+        import rasterio.windows
+    except ImportError as e:
+        raise ImportError("Georeferenced rasters need rasterio, install it with: pip install -r requirements-geo.txt") from e
+    return rasterio
+
+
+def chunk_windows(height, width, chunk_size):
+    """Yields (row, col, y, x, h, w) for the chunks covering a raster, row by row."""
+    for row, y in enumerate(range(0, height, chunk_size)):
+        for col, x in enumerate(range(0, width, chunk_size)):
+            yield row, col, y, x, min(chunk_size, height - y), min(chunk_size, width - x)
+
+
+def to_uint8(data, value_range=None):
+    """
+    Converts bands of shape (bands, H, W) to the (H, W, 3) uint8 RGB the model expects.
+
+    Parameters:
+        data (np.ndarray): Raster bands as read by rasterio.
+        value_range (tuple): (low, high) source values mapped to 0 and 255, e.g. (0, 10000)
+            for 16-bit reflectances. Needed unless the raster is uint8 already.
+    """
+    if value_range is None:
+        if data.dtype != np.uint8:
+            raise ValueError(f"Rasters of type {data.dtype} need a value_range to be scaled to 8 bits")
+    else:
+        low, high = value_range
+        data = np.clip((data.astype(np.float32) - low) * (255.0 / (high - low)), 0, 255).astype(np.uint8)
+    image = np.ascontiguousarray(np.moveaxis(data, 0, -1))
+    return load_image(image[..., 0] if image.shape[2] == 1 else image)
+
+
+class _Components:
+    """
+    Wellpads found chunk by chunk. Components that touch across a chunk border are joined with
+    a union-find, and their statistics are summed when the scene is done.
+    """
+
+    def __init__(self):
+        self.parent = []
+        self.stats = []  # [area, x0, y0, x1, y1, prob_sum, x_sum, y_sum, seed_x, seed_y] in scene pixels
+
+    def add(self, mask, prob, x, y):
+        """
+        Labels the mask of the chunk at (x, y) and returns the scene-wide id of every pixel,
+        -1 for the background.
+        """
+        num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        areas = stats[:, cv2.CC_STAT_AREA]
+        prob_sums = np.bincount(labels.ravel(), weights=prob.ravel().astype(np.float64), minlength=num_labels)
+        _, first = np.unique(labels.ravel(), return_index=True)
+        width = mask.shape[1]
+
+        ids = np.full(num_labels, -1, dtype=np.int64)
+        for label in range(1, num_labels):
+            ids[label] = len(self.parent)
+            self.parent.append(ids[label])
+            left, top, w, h = stats[label, :4]
+            self.stats.append([
+                int(areas[label]), x + int(left), y + int(top), x + int(left + w), y + int(top + h),
+                float(prob_sums[label]),
+                float(centroids[label, 0] + x) * areas[label], float(centroids[label, 1] + y) * areas[label],
+                x + int(first[label] % width), y + int(first[label] // width)
+            ])
+        return ids[labels]
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def join(self, edge, neighbour):
+        """
+        Joins the components of two adjacent pixel lines (the first row or column of a chunk and
+        the last one of its neighbour), including diagonal contacts.
+        """
+        n = len(edge)
+        for shift in (-1, 0, 1):
+            a = edge[max(0, shift):n + min(0, shift)]
+            b = neighbour[max(0, -shift):n + min(0, -shift)]
+            touching = (a >= 0) & (b >= 0)
+            for i, j in set(zip(a[touching].tolist(), b[touching].tolist())):
+                root_i, root_j = self.find(i), self.find(j)
+                if root_i != root_j:
+                    self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def merged(self):
+        """Statistics of every wellpad after joining, as dicts in scene pixels."""
+        groups = {}
+        for i, row in enumerate(self.stats):
+            root = self.find(i)
+            group = groups.get(root)
+            if group is None:
+                groups[root] = list(row)
+                continue
+            group[0] += row[0]
+            group[1], group[2] = min(group[1], row[1]), min(group[2], row[2])
+            group[3], group[4] = max(group[3], row[3]), max(group[4], row[4])
+            group[5] += row[5]
+            group[6] += row[6]
+            group[7] += row[7]
+        return [
+            {
+                "area": area,
+                "bbox": [x0, y0, x1 - x0, y1 - y0],
+                "centroid": [x_sum / area, y_sum / area],
+                "confidence": prob_sum / area,
+                "seed": (seed_x, seed_y)
+            }
+            for area, x0, y0, x1, y1, prob_sum, x_sum, y_sum, seed_x, seed_y in groups.values()
+        ]
+
+
+def detect_raster(source, mask_path, geojson_path=None, threshold=0.5, tile_size=256, overlap=32,
+                  batch_size=8, chunk_size=2048, bands=None, value_range=None, min_area=0,
+                  wgs84=True, predict_fn=None, progress=None, screen_scale=0, screen_threshold=0.1):
+    """
+    Detects wellpads in a georeferenced raster without loading the whole scene.
+
+    Parameters:
+        source (str): Path of the raster.
+        mask_path (str): GeoTIFF written with the binary mask (0 or 255), tiled 256x256 and
+            deflate-compressed, with the CRS and geotransform of the source.
+        geojson_path (str): Optional GeoJSON file written with one feature per wellpad.
+        threshold (float): Threshold to convert prediction to binary mask.
+        tile_size (int): Size of the model windows.
+        overlap (int): Overlap between the model windows, also the margin of context read
+            around every chunk.
+        batch_size (int): Number of windows per forward pass.
+        chunk_size (int): Side of the square chunks read and written at once; the memory
+            used grows with its square, not with the scene.
+        bands (tuple): 1-based band indexes used as RGB. Defaults to the first three bands,
+            or the first band of single band rasters.
+        value_range (tuple): Source values mapped to 0 and 255 for rasters that are not uint8.
+        min_area (int): Wellpads smaller than this many pixels are not reported.
+        wgs84 (bool): Write the GeoJSON in longitude/latitude (RFC 7946) instead of the CRS of
+            the source.
+        predict_fn (callable): Function mapping a batch of windows to probabilities.
+        progress (callable): Called with the completed fraction of the chunks.
+        screen_scale (float): Downsampling factor of the screening pass that skips the windows
+            without wellpads in every chunk, 0 disables it.
+        screen_threshold (float): Coarse probability from which a window is predicted.
+
+    Returns:
+        dict: The 'shape' of the scene as [height, width], its 'crs' and the 'detections'
+            statistics with the wellpads in map coordinates.
+    """
+    rasterio = _rasterio()
+    predict_fn = predict_fn or predict_batch
+    components = _Components()
+
+    with rasterio.open(source) as src:
+        if bands is None:
+            bands = (1, 2, 3) if src.count >= 3 else (1,)
+        height, width = src.height, src.width
+        profile = {
+            'driver': 'GTiff', 'dtype': 'uint8', 'count': 1, 'height': height, 'width': width,
+            'crs': src.crs, 'transform': src.transform, 'tiled': True, 'blockxsize': 256,
+            'blockysize': 256, 'compress': 'deflate', 'BIGTIFF': 'IF_SAFER'
+        }
+        Path(mask_path).parent.mkdir(parents=True, exist_ok=True)
+        chunks = list(chunk_windows(height, width, chunk_size))
+        logger.info(f"Detecting wellpads in {source} ({width}x{height}) in {len(chunks)} chunks")
+
+        above = np.full(width, -1, dtype=np.int64)  # Ids of the last row of the previous chunk row
+        below = np.full(width, -1, dtype=np.int64)
+        covered = 0
+        with rasterio.open(mask_path, 'w', **profile) as dst:
+            for done, (row, col, y, x, h, w) in enumerate(chunks):
+                if col == 0 and row > 0:
+                    above, below = below, above
+                # Read the chunk with its margin, clamped to the scene
+                top, left = max(y - overlap, 0), max(x - overlap, 0)
+                bottom, right = min(y + h + overlap, height), min(x + w + overlap, width)
+                window = rasterio.windows.Window(left, top, right - left, bottom - top)
+                with stage('read_window'):
+                    data = src.read(indexes=list(bands), window=window)
+                    valid = src.dataset_mask(window=rasterio.windows.Window(x, y, w, h))
+                img = to_uint8(data, value_range)
+
+                prob = predict_tiled(img, tile_size=tile_size, overlap=overlap, batch_size=batch_size,
+                                     predict_fn=predict_fn, screen_scale=screen_scale,
+                                     screen_threshold=screen_threshold)
+                prob = np.ascontiguousarray(prob[y - top:y - top + h, x - left:x - left + w])
+                mask = ((prob > threshold) & (valid > 0)).astype(np.uint8)
+
+                with stage('write_window'):
+                    dst.write(mask * 255, 1, window=rasterio.windows.Window(x, y, w, h))
+
+                ids = components.add(mask, prob, x, y)
+                if col > 0:
+                    components.join(ids[:, 0], left_column)
+                if row > 0:
+                    # The row above spans one more pixel on each side for the diagonal contacts
+                    start, end = max(x - 1, 0), min(x + w + 1, width)
+                    edge = np.full(end - start, -1, dtype=np.int64)
+                    edge[x - start:x - start + w] = ids[0]
+                    components.join(edge, above[start:end])
+                left_column = ids[:, -1]
+                below[x:x + w] = ids[-1]
+                covered += int(mask.sum())
+                if progress is not None:
+                    progress((done + 1) / len(chunks))
+
+        wellpads = [wellpad for wellpad in components.merged() if wellpad['area'] >= min_area]
+        transform, crs = src.transform, src.crs
+
+    features = _features(rasterio, mask_path, wellpads, transform, crs, wgs84)
+    results = {
+        'shape': [height, width],
+        'crs': str(crs) if crs else None,
+        'detections': {
+            'count': len(features),
+            'coverage_percent': round(100.0 * sum(w['area'] for w in wellpads) / float(height * width), 4),
+            'wellpads': [feature['properties'] for feature in features]
+        }
+    }
+    if geojson_path is not None:
+        collection = {'type': 'FeatureCollection', 'features': features}
+        if crs and not wgs84:
+            collection['crs'] = {'type': 'name', 'properties': {'name': str(crs)}}
+        Path(geojson_path).write_text(json.dumps(collection))
+        logger.info(f"Wrote {len(features)} wellpads to {geojson_path}")
+    return results
+
+
+def _features(rasterio, mask_path, wellpads, transform, crs, wgs84):
+    """
+    GeoJSON features of the wellpads. Each outline is traced on the window of its bounding box
+    read back from the written mask, so no more than one wellpad is in memory at a time.
+    """
+    pixel_area = abs(transform.a * transform.e - transform.b * transform.d)
+    reproject = bool(crs) and wgs84 and not crs.is_geographic
+    features = []
+    with rasterio.open(mask_path) as mask_src:
+        for i, wellpad in enumerate(wellpads, start=1):
+            x0, y0, w, h = wellpad['bbox']
+            window = rasterio.windows.Window(x0, y0, w, h)
+            labels = cv2.connectedComponents((mask_src.read(1, window=window) > 0).astype(np.uint8),
+                                             connectivity=8)[1]
+            seed_x, seed_y = wellpad['seed']
+            region = labels == labels[seed_y - y0, seed_x - x0]
+            shapes = [geometry for geometry, _ in rasterio.features.shapes(
+                region.astype(np.uint8), mask=region, connectivity=8,
+                transform=rasterio.windows.transform(window, transform))]
+            geometry = shapes[0] if len(shapes) == 1 else {
+                'type': 'MultiPolygon', 'coordinates': [shape['coordinates'] for shape in shapes]}
+
+            cx, cy = transform * (wellpad['centroid'][0] + 0.5, wellpad['centroid'][1] + 0.5)
+            if reproject:
+                geometry = rasterio.warp.transform_geom(crs, 'EPSG:4326', geometry)
+                (cx,), (cy,) = rasterio.warp.transform(crs, 'EPSG:4326', [cx], [cy])
+            features.append({
+                'type': 'Feature',
+                'geometry': geometry,
+                'properties': {
+                    'id': i,
+                    'bbox': [int(v) for v in wellpad['bbox']],
+                    'area': int(wellpad['area']),
+                    'area_map_units': round(wellpad['area'] * pixel_area, 4),
+                    'centroid': [round(float(cx), 8), round(float(cy), 8)],
+                    'confidence': round(float(wellpad['confidence']), 4)
+                }
+            })
+    return features
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Georeferenced raster, e.g. a GeoTIFF')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output prefix: <output>_mask.tif and <output>.geojson are written')
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--overlap', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--chunk-size', type=int, default=2048)
+    parser.add_argument('--bands', default=None, help='Comma separated 1-based band indexes used as RGB')
+    parser.add_argument('--value-range', default=None, help='low,high source values mapped to 0 and 255')
+    parser.add_argument('--min-area', type=int, default=0)
+    parser.add_argument('--screen-scale', type=float, default=0,
+                        help='Downsampling factor of the screening pass, 0 predicts every window')
+    parser.add_argument('--screen-threshold', type=float, default=0.1)
+    parser.add_argument('--native-crs', action='store_true', help='Write the GeoJSON in the CRS of the source')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = detect_raster(
+        args.source,
+        f'{args.output}_mask.tif',
+        f'{args.output}.geojson',
+        threshold=args.threshold,
+        overlap=args.overlap,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        bands=tuple(int(b) for b in args.bands.split(',')) if args.bands else None,
+        value_range=tuple(float(v) for v in args.value_range.split(',')) if args.value_range else None,
+        min_area=args.min_area,
+        wgs84=not args.native_crs,
+        screen_scale=args.screen_scale,
+        screen_threshold=args.screen_threshold,
+        progress=lambda fraction: logger.info(f"{100 * fraction:.0f}% of the chunks done"))
+    logger.info(f"Found {results['detections']['count']} wellpads in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
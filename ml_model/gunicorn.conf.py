@@ -0,0 +1,41 @@
+import os
+import tempfile
+from pathlib import Path
+
+# Gunicorn configuration for the detection API.
+#
+# With GUNICORN_PRELOAD=true the application (Flask, OpenCV, TensorFlow) is imported once in the
+# master process and the forked workers share those pages copy-on-write. The model itself is
+# loaded in each worker after the fork: the TensorFlow runtime does not survive fork(), so a
+# model loaded in the master would hang the workers on their first prediction.
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+if preload_app:
+    # Read by ml_model.app at import time, which happens in the master when preloading
+    os.environ['LOAD_MODEL_ON_IMPORT'] = 'false'
+
+# The workers share their metrics through this directory, so /metrics answers with the totals
+# of the server whichever worker serves the scrape
+os.environ.setdefault('METRICS_DIR', str(Path(tempfile.gettempdir()) / 'dopa-metrics'))
+
+
+def on_starting(server):
+    """Start the metrics of a new server from zero, the files of its old workers are removed."""
+    for path in Path(os.environ['METRICS_DIR']).glob('*.json'):
+        path.unlink(missing_ok=True)
+
+
+def post_fork(server, worker):
+    """Load and warm up the model in every worker once it has been forked."""
+    if preload_app:
+        from ml_model.detect import registry
+        try:
+            registry.preload()
+        except Exception as e:
+            # The worker keeps serving health checks, which report the model as not ready
+            server.log.error(f"Worker {worker.pid} failed to load the model: {e}")
@@ -0,0 +1,279 @@
+"""
+Incremental re-detection of areas that are scanned again and again.
+
+The window predictions of the last scene of every area are kept on disk. When a new scene of
+the same area arrives, every window is compared with the stored one: identical pixels (same
+digest) or a small perceptual difference (largest change of a 32x32 grayscale thumbnail below
+the tolerance) reuse the stored prediction, only the changed windows go through the model.
+The wellpads are then compared with those of the last scene, which gives the wellpads that
+appeared and disappeared. Scenes of an area must be co-registered: same size, same pixel grid.
+
+Run from the repository root:
+
+    python -m ml_model.incremental scene.png --area permian-12 --store results/areas -o results/permian-12
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from ml_model.detect import detect_wellpads, load_image, registry
+
+logger = logging.getLogger(__name__)
+
+_AREA_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+
+
+def _thumbnail(window, size):
+    gray = cv2.cvtColor(np.ascontiguousarray(window), cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+
+
+class AreaTiles:
+    """
+    The stored windows of one area, used as the tile_cache of predict_tiled.
+
+    Stored windows are read lazily and new predictions are written as they arrive, each to its
+    own file, so a scene never holds more than one batch of stored windows in memory.
+    """
+
+    def __init__(self, directory, settings, shape, tolerance=8.0, thumbnail_size=32):
+        self.directory = Path(directory)
+        self.settings = settings
+        self.shape = list(shape)
+        self.tolerance = tolerance
+        self.thumbnail_size = thumbnail_size
+        self.previous = None
+
+        meta = self.__read_meta()
+        if meta is not None and meta.get('settings') == settings and meta.get('shape') == self.shape:
+            self.previous = meta
+        else:
+            # Predictions of another model, other settings or another grid cannot be reused, and
+            # without metadata (e.g. an interrupted first run) nothing tells what the tiles hold
+            if meta is not None:
+                logger.info(f"Settings or size of area {self.directory.name} changed, starting over")
+            shutil.rmtree(self.directory / 'tiles', ignore_errors=True)
+        (self.directory / 'tiles').mkdir(parents=True, exist_ok=True)
+
+        # Statistics
+        self.identical = 0
+        self.similar = 0
+        self.changed = 0
+        self.new = 0
+
+    @property
+    def previous_detections(self):
+        return self.previous['detections'] if self.previous else None
+
+    def get(self, y, x, window):
+        """The stored prediction of the window at (y, x) if the window did not change, else None."""
+        path = self.__tile_path(y, x)
+        try:
+            with np.load(path) as tile:
+                digest, thumbnail, prob = str(tile['digest']), tile['thumbnail'], tile['prob']
+        except (OSError, KeyError, ValueError):
+            self.new += 1
+            return None
+
+        if digest == self.__digest(window):
+            self.identical += 1
+            return prob
+        difference = np.abs(_thumbnail(window, self.thumbnail_size).astype(np.int16) - thumbnail).max()
+        if difference <= self.tolerance:
+            # The stored window stays the reference, so slow drifts still add up to a change
+            self.similar += 1
+            return prob
+        self.changed += 1
+        return None
+
+    def put(self, y, x, window, prob):
+        """Store the prediction of the window at (y, x)."""
+        path = self.__tile_path(y, x)
+        tmp_path = path.with_name(f'{path.stem}.{os.getpid()}.tmp.npz')
+        np.savez_compressed(
+            tmp_path,
+            digest=np.array(self.__digest(window)),
+            thumbnail=_thumbnail(window, self.thumbnail_size),
+            prob=np.asarray(prob, dtype=np.float32))
+        os.replace(tmp_path, path)
+
+    def commit(self, detections):
+        """Record the detections of the scene, the reference for the next diff."""
+        meta = {'settings': self.settings, 'shape': self.shape, 'detections': detections, 'updated': time.time()}
+        path = self.directory / 'meta.json'
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        reused = self.identical + self.similar
+        return {
+            "windows": reused + self.changed + self.new,
+            "reused": reused,
+            "identical": self.identical,
+            "similar": self.similar,
+            "changed": self.changed,
+            "new": self.new
+        }
+
+    def __digest(self, window):
+        return hashlib.sha256(np.ascontiguousarray(window).tobytes()).hexdigest()
+
+    def __tile_path(self, y, x):
+        return self.directory / 'tiles' / f'{y}_{x}.npz'
+
+    def __read_meta(self):
+        try:
+            with open(self.directory / 'meta.json') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+class TileStore:
+    """
+    Window predictions and detections of the last scene of every area, below root:
+
+        <root>/<area>/meta.json             settings, scene size and detections
+        <root>/<area>/tiles/<y>_<x>.npz     digest, thumbnail and probabilities of one window
+    """
+
+    def __init__(self, root, tolerance=8.0, thumbnail_size=32):
+        self.root = Path(root)
+        self.tolerance = tolerance
+        self.thumbnail_size = thumbnail_size
+
+    def open(self, area, settings, shape):
+        """The stored windows of area, emptied when settings or the scene shape changed."""
+        if not _AREA_NAME.match(area):
+            raise ValueError(f"Invalid area name '{area}', use letters, digits, '.', '_' and '-'")
+        return AreaTiles(self.root / area, settings, shape, self.tolerance, self.thumbnail_size)
+
+
+def _iou(box, boxes):
+    """Overlap (intersection over union) of one [x, y, w, h] box with every row of boxes."""
+    x, y, w, h = box
+    widths = np.minimum(x + w, boxes[:, 0] + boxes[:, 2]) - np.maximum(x, boxes[:, 0])
+    heights = np.minimum(y + h, boxes[:, 1] + boxes[:, 3]) - np.maximum(y, boxes[:, 1])
+    intersection = np.clip(widths, 0, None) * np.clip(heights, 0, None)
+    return intersection / (w * h + boxes[:, 2] * boxes[:, 3] - intersection)
+
+
+def diff_detections(previous, current, min_iou=0.3):
+    """
+    Matches the wellpads of two scenes of an area by the overlap of their boxes, best
+    overlaps first.
+
+    Returns:
+        dict: The wellpads of current that match none of previous ('appeared'), those of
+            previous that match none of current ('disappeared') and the number matched.
+    """
+    boxes = np.array([c['bbox'] for c in current], dtype=np.float64).reshape(-1, 4)
+    pairs = []
+    for i, p in enumerate(previous):
+        if len(boxes) == 0:
+            break
+        ious = _iou(p['bbox'], boxes)
+        pairs.extend((float(ious[j]), i, int(j)) for j in np.flatnonzero(ious >= min_iou))
+    matched_previous, matched_current = set(), set()
+    for iou, i, j in sorted(pairs, reverse=True):
+        if i not in matched_previous and j not in matched_current:
+            matched_previous.add(i)
+            matched_current.add(j)
+    return {
+        "appeared": [c for j, c in enumerate(current) if j not in matched_current],
+        "disappeared": [p for i, p in enumerate(previous) if i not in matched_previous],
+        "matched": len(matched_current)
+    }
+
+
+def detect_incremental(image, store, area, threshold=0.5, overlap=32, batch_size=8, predict_fn=None,
+                       model_id=None, outputs=('mask',), min_area=0, tta=False, min_iou=0.3):
+    """
+    Detects wellpads in a new scene of an area, predicting only the windows that changed.
+
+    Parameters:
+        image: Scene as a path, encoded bytes or an RGB array.
+        store (TileStore): Store of the previous scenes.
+        area (str): Name of the area the scene covers.
+        model_id (str): Identity of predict_fn, stored predictions of another model are not
+            reused. Defaults to the identity of the loaded model.
+        min_iou (float): Box overlap from which a wellpad is the same as one of the last scene.
+        See detect_wellpads for the other parameters.
+
+    Returns:
+        dict: The results of detect_wellpads with a 'changes' entry: the window statistics
+            and the wellpads that 'appeared' and 'disappeared' since the last scene, or None
+            for both on the first scene of the area.
+    """
+    img = load_image(image)
+    settings = {
+        'model': model_id or registry.get().identity,
+        'tile_size': 256,
+        'overlap': overlap,
+        'tta': tta
+    }
+    tiles = store.open(area, settings, img.shape[:2])
+    results = detect_wellpads(img, tiled=True, threshold=threshold, overlap=overlap, batch_size=batch_size,
+                              predict_fn=predict_fn, outputs=outputs, min_area=min_area, tta=tta,
+                              tile_cache=tiles)
+
+    wellpads = results['detections']['wellpads']
+    previous = tiles.previous_detections
+    diff = diff_detections(previous['wellpads'], wellpads, min_iou) if previous is not None else None
+    tiles.commit(results['detections'])
+    results['changes'] = {
+        "windows": tiles.stats(),
+        "appeared": diff['appeared'] if diff else None,
+        "disappeared": diff['disappeared'] if diff else None
+    }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('image', help='New scene of the area')
+    parser.add_argument('--area', required=True, help='Name of the area the scene covers')
+    parser.add_argument('--store', required=True, help='Directory of the stored areas')
+    parser.add_argument('-o', '--output', required=True,
+                        help='Output prefix: <output>_mask.png and <output>.json are written')
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--overlap', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--tolerance', type=float, default=8.0,
+                        help='Largest thumbnail change, in gray levels, of a window that is reused (0: identical only)')
+    parser.add_argument('--min-area', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = detect_incremental(args.image, TileStore(args.store, tolerance=args.tolerance), args.area,
+                                 threshold=args.threshold, overlap=args.overlap, batch_size=args.batch_size,
+                                 min_area=args.min_area)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with open(f'{args.output}_mask.png', 'wb') as f:
+        f.write(results.pop('mask'))
+    with open(f'{args.output}.json', 'w') as f:
+        json.dump(results, f)
+
+    changes = results['changes']
+    summary = {"windows": changes['windows'], "seconds": round(time.perf_counter() - start, 2)}
+    if changes['appeared'] is not None:
+        summary.update(appeared=len(changes['appeared']), disappeared=len(changes['disappeared']))
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import uuid
+import queue
+import pickle
+import tempfile
+import threading
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+# Progress is written to the status file when it advanced this much, or after this many seconds
+PROGRESS_WRITE_STEP = 0.05
+PROGRESS_WRITE_SECONDS = 1.0
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is full."""
+
+
+class ClientError(Exception):
+    """Raised by a job whose input is invalid; the job fails with status_code instead of a 500."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class JobManager:
+    """
+    Runs long detections in background worker threads and tracks their progress.
+
+    Jobs wait in a bounded queue; submitting to a full queue raises QueueFullError so the API
+    can push back instead of piling up work. The state of every job is also written to
+    store_dir, so with several server processes sharing the directory any of them can answer
+    status and result requests, whichever process ran the job.
+    """
+
+    def __init__(self, num_workers=2, max_queue=8, store_dir=None, ttl_seconds=3600):
+        self.num_workers = num_workers
+        self.max_queue = max_queue
+        self.store_dir = Path(store_dir or Path(tempfile.gettempdir()) / 'dopa-jobs')
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._last_cleanup = time.time()
+        self._progress_written = {}
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, progress=callback, **kwargs) and return the job id. The callback takes
+        the completed fraction in [0, 1].
+        """
+        self._ensure_workers()
+        self._cleanup()
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "progress": 0.0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "error_status": None
+        }
+        with self._lock:
+            try:
+                self._queue.put_nowait((job_id, fn, args, kwargs))
+            except queue.Full:
+                raise QueueFullError(f"Job queue is full ({self.max_queue} jobs waiting)")
+            self._jobs[job_id] = job
+        self._save_status(job)
+        return job_id
+
+    def status(self, job_id):
+        """Return the state of a job, or None if it is unknown or expired."""
+        if not self._valid_id(job_id):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        try:
+            with open(self._status_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def result(self, job_id):
+        """Return the result of a finished job, or None if it has no result."""
+        if not self._valid_id(job_id):
+            return None
+        try:
+            with open(self._result_path(job_id), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def stats(self):
+        """Queue depth and number of tracked jobs per status."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                "max_queue": self.max_queue,
+                "workers": self.num_workers,
+                "jobs": counts
+            }
+
+    def _ensure_workers(self):
+        """Start the worker threads on first use, again in every forked server process."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._jobs = {}
+            self._threads = [
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.num_workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            job_id, fn, args, kwargs = self._queue.get()
+            self._update(job_id, status="running", started_at=time.time())
+            try:
+                result = fn(*args, progress=lambda fraction: self._progress(job_id, fraction), **kwargs)
+                self._save_result(job_id, result)
+                self._update(job_id, status="done", progress=1.0, finished_at=time.time())
+            except ClientError as e:
+                logger.warning(f"Job {job_id} rejected: {e}")
+                self._update(job_id, status="failed", error=str(e), error_status=e.status_code,
+                             finished_at=time.time())
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                self._update(job_id, status="failed", error=str(e), error_status=500, finished_at=time.time())
+            finally:
+                with self._lock:
+                    self._progress_written.pop(job_id, None)
+                self._queue.task_done()
+
+    def _progress(self, job_id, fraction):
+        # Written out every PROGRESS_WRITE_STEP or PROGRESS_WRITE_SECONDS, so the other server
+        # processes see the progress without a write per window
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["progress"] = round(min(max(float(fraction), 0.0), 1.0), 4)
+            written, written_at = self._progress_written.get(job_id, (0.0, 0.0))
+            if job["progress"] - written < PROGRESS_WRITE_STEP and now - written_at < PROGRESS_WRITE_SECONDS:
+                return
+            self._progress_written[job_id] = (job["progress"], now)
+            job = dict(job)
+        self._save_status(job)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job = dict(job)
+        self._save_status(job)
+
+    def _valid_id(self, job_id):
+        return len(job_id) == 32 and all(c in '0123456789abcdef' for c in job_id)
+
+    def _status_path(self, job_id):
+        return self.store_dir / f'{job_id}.json'
+
+    def _result_path(self, job_id):
+        return self.store_dir / f'{job_id}.pkl'
+
+    def _save_status(self, job):
+        path = self._status_path(job["job_id"])
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _save_result(self, job_id, result):
+        path = self._result_path(job_id)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def _cleanup(self):
+        """
+        Forget jobs finished more than ttl_seconds ago, at most once a minute. Queued and running
+        jobs are kept, however old, their owner may be another process.
+        """
+        now = time.time()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job["finished_at"] is not None and now - job["finished_at"] > self.ttl_seconds]
+            for job_id in expired:
+                del self._jobs[job_id]
+        for path in self.store_dir.glob('*.json'):
+            try:
+                # The file is only rewritten on updates, so its age says nothing about the job
+                if now - path.stat().st_mtime <= self.ttl_seconds:
+                    continue
+                with open(path) as f:
+                    finished_at = json.load(f).get("finished_at")
+                if finished_at is not None and now - finished_at > self.ttl_seconds:
+                    path.unlink()
+                    self._result_path(path.stem).unlink(missing_ok=True)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
@@ -0,0 +1,373 @@
+import os
+import json
+import atexit
+import time
+import random
+import bisect
+import cProfile
+import threading
+import logging
+from contextlib import nullcontext
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds, +Inf is always added
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KiB to 256 MiB
+PIXELS_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with an optional set of labels.
+
+    observe() does one bisect and a few additions under a lock; the cumulative bucket counts
+    are only computed when the histogram is rendered.
+    """
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        """Record value for the given label values, in the order of labelnames."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                if len(labels) != len(self.labelnames):
+                    raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+                # Counts per bucket (the last one is +Inf), then sum and count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """The state of every series: {labels: [bucket counts, sum, count]}."""
+        with self._lock:
+            return {labels: [list(counts), total, count] for labels, (counts, total, count) in self._series.items()}
+
+    @staticmethod
+    def merge(into, snapshot):
+        """Add the series of snapshot to those of into."""
+        for labels, (counts, total, count) in snapshot.items():
+            series = into.get(labels)
+            if series is None:
+                into[labels] = [list(counts), total, count]
+            else:
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def render(self, snapshot=None):
+        """Lines of the text exposition format, of this process or of a merged snapshot."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                label_text = _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{label_text} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(total)}')
+            lines.append(f'{self.name}_count{label_text} {count}')
+        return lines
+
+
+class Counter:
+    """Prometheus-style counter with an optional set of labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(into, snapshot):
+        for labels, value in snapshot.items():
+            into[labels] = into.get(labels, 0) + value
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self, snapshot=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class _StageTimer:
+    """Context manager observing the time spent in its block."""
+
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+_DISABLED = nullcontext()
+
+
+class MetricsRegistry:
+    """
+    The metrics of one process, rendered together in the Prometheus text format.
+
+    When disabled, timers are a shared no-op context manager and observations return after
+    one attribute check, so the instrumentation can stay in the hot path.
+
+    Several processes serving the same port (gunicorn workers) share their metrics through a
+    directory, see share(): render() then returns the sum over all of them.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+        self.directory = None
+        self.interval = 1.0
+        self._writer_pid = None
+        self._started = None
+        self._written = None
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        metric = Histogram(name, documentation, buckets, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def timer(self, histogram, *labels):
+        """Time a block into histogram, or do nothing while disabled."""
+        if not self.enabled:
+            return _DISABLED
+        return _StageTimer(histogram, labels)
+
+    def observe(self, histogram, value, *labels):
+        if self.enabled:
+            histogram.observe(value, *labels)
+
+    def inc(self, counter, *labels, amount=1):
+        if self.enabled:
+            counter.inc(*labels, amount=amount)
+
+    def share(self, directory, interval=1.0):
+        """
+        Aggregate the metrics of every process using directory.
+
+        Each process writes its metrics to its own file in directory every interval seconds
+        (and when it renders them); render() merges the files of all processes. The files of
+        exited processes are kept, so totals never decrease when a worker is replaced; clear
+        the directory when the server starts, not while it runs.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        os.register_at_fork(after_in_child=self.__after_fork)
+        # The last observations of an exiting worker are not lost
+        atexit.register(self.write)
+        self.__start_writer()
+
+    def write(self):
+        """Write the metrics of this process to its file in the shared directory."""
+        state = json.dumps({metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+                            for metric in self._metrics})
+        if state == self._written:
+            return
+        path = self.directory / f'{os.getpid()}-{self._started}.json'
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(state)
+        os.replace(tmp_path, path)
+        self._written = state
+
+    def render(self):
+        if self.directory is None:
+            snapshots = {metric.name: None for metric in self._metrics}
+        else:
+            snapshots = self.__merged()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(snapshots[metric.name]))
+        return '\n'.join(lines) + '\n'
+
+    def __merged(self):
+        try:
+            self.write()
+        except OSError as e:
+            logger.error(f"Failed to write the metrics to {self.directory}: {e}")
+        snapshots = {metric.name: {} for metric in self._metrics}
+        for path in self.directory.glob('*.json'):
+            try:
+                state = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue  # Removed or being replaced
+            for metric in self._metrics:
+                series = {tuple(labels): value for labels, value in state.get(metric.name, [])}
+                metric.merge(snapshots[metric.name], series)
+        return snapshots
+
+    def __start_writer(self):
+        self._writer_pid = os.getpid()
+        self._started = time.time_ns()
+        self._written = None
+        threading.Thread(target=self.__write_loop, name='metrics-writer', daemon=True).start()
+
+    def __write_loop(self):
+        pid = os.getpid()
+        while self._writer_pid == pid:
+            try:
+                self.write()
+            except OSError as e:
+                logger.error(f"Failed to write the metrics to {self.directory}: {e}")
+            time.sleep(self.interval)
+
+    def __after_fork(self):
+        # A forked worker starts from zero with its own file, the parent keeps counting its own
+        for metric in self._metrics:
+            metric.reset()
+        self.__start_writer()
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    'dopa_stage_seconds', 'Time spent in each stage of a detection.', LATENCY_BUCKETS, ('stage',))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'dopa_http_request_seconds', 'Time to answer an HTTP request.', LATENCY_BUCKETS, ('endpoint', 'status'))
+HTTP_REQUEST_BYTES = metrics.histogram(
+    'dopa_http_request_bytes', 'Size of the HTTP request bodies.', BYTES_BUCKETS, ('endpoint',))
+HTTP_RESPONSE_BYTES = metrics.histogram(
+    'dopa_http_response_bytes', 'Size of the HTTP response bodies.', BYTES_BUCKETS, ('endpoint',))
+IMAGE_PIXELS = metrics.histogram(
+    'dopa_image_pixels', 'Width and height of the decoded input images.', PIXELS_BUCKETS, ('dimension',))
+TILES = metrics.counter(
+    'dopa_tiles_total', 'Windows of tiled inference, predicted, skipped by screening or reused from the tile cache.', ('decision',))
+PROFILES = metrics.counter(
+    'dopa_profiles_total', 'Requests run under the sampling profiler.', ('name',))
+
+
+def stage(name):
+    """
+    Time a stage of the detection pipeline.
+
+    Usage:
+        with stage('decode'):
+            img = load_image(image)
+    """
+    return metrics.timer(STAGE_SECONDS, name)
+
+
+def observe_image(shape):
+    """Record the height and width of a decoded image."""
+    if metrics.enabled:
+        IMAGE_PIXELS.observe(shape[0], 'height')
+        IMAGE_PIXELS.observe(shape[1], 'width')
+
+
+class SampledProfiler:
+    """
+    Runs a random fraction of the requests under cProfile and writes their statistics to
+    output_dir as <name>-<pid>-<timestamp>.prof files, readable with pstats or snakeviz.
+
+    At most one request per process is profiled at a time and only the newest max_files
+    files are kept. With a rate of 0 sample() costs one comparison.
+    """
+
+    def __init__(self, rate=0.0, output_dir=None, max_files=100):
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError(f"rate must be between 0 and 1, got {rate}")
+        self.rate = rate
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def sample(self, name):
+        """Context manager profiling its block when the request is sampled."""
+        if self.rate <= 0.0 or random.random() >= self.rate or self.output_dir is None:
+            return _DISABLED
+        return _Profile(self, name)
+
+    def _save(self, profile, name):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / f'{name}-{os.getpid()}-{time.time_ns()}.prof'
+        profile.dump_stats(str(path))
+        PROFILES.inc(name)
+        logger.info(f"Profile of {name} written to {path}")
+        files = sorted(self.output_dir.glob('*.prof'), key=lambda p: p.stat().st_mtime)
+        for old in files[:max(0, len(files) - self.max_files)]:
+            old.unlink(missing_ok=True)
+
+
+class _Profile:
+    __slots__ = ('profiler', 'name', 'profile')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        # Skip the sample rather than wait while another request is profiled
+        if self.profiler._lock.acquire(blocking=False):
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+            try:
+                self.profiler._save(self.profile, self.name)
+            except OSError as e:
+                logger.error(f"Failed to save profile of {self.name}: {e}")
+            finally:
+                self.profiler._lock.release()
+        return False
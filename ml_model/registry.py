@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Holds the inference engine of the current process.
+
+    The engine is loaded at most once per process by the loader callable and warmed up once.
+    Readiness and liveness are answered from the cached state, so health probes never touch
+    the model file or TensorFlow.
+    """
+
+    def __init__(self, loader, warmup_batch_sizes=(1,)):
+        self._loader = loader
+        self.warmup_batch_sizes = tuple(warmup_batch_sizes)
+        self._lock = threading.Lock()
+        self._engine = None
+        self._warmed_up = False
+        self._error = None
+        self._loaded_at = None
+        self._load_seconds = None
+        self._warmup_seconds = None
+        self._pid = os.getpid()
+        self._started_at = time.time()
+
+    def get(self):
+        """Return the engine, loading and warming it up on first use."""
+        engine = self._engine
+        if engine is not None and self._warmed_up:
+            return engine
+        return self.preload(warmup=True)
+
+    def preload(self, warmup=True):
+        """Load the engine if it is not loaded yet and optionally warm it up."""
+        with self._lock:
+            if self._engine is None:
+                start = time.perf_counter()
+                try:
+                    self._engine = self._loader()
+                except Exception as e:
+                    self._error = str(e)
+                    logger.error(f"Model registry failed to load the model: {e}")
+                    raise
+                self._error = None
+                self._loaded_at = time.time()
+                self._load_seconds = time.perf_counter() - start
+                self._pid = os.getpid()
+                logger.info(f"Model loaded in {self._load_seconds:.2f}s by process {self._pid}")
+
+            if warmup and not self._warmed_up:
+                start = time.perf_counter()
+                self._engine.warmup(self.warmup_batch_sizes)
+                self._warmup_seconds = time.perf_counter() - start
+                self._warmed_up = True
+            return self._engine
+
+    def is_ready(self):
+        """The model is loaded and can serve requests."""
+        return self._engine is not None
+
+    def is_alive(self):
+        """The registry is usable: either loaded or not yet failed."""
+        return self._engine is not None or self._error is None
+
+    def status(self):
+        """Cached load state of the model, cheap enough for every health probe."""
+        return {
+            "ready": self.is_ready(),
+            "warmed_up": self._warmed_up,
+            "error": self._error,
+            "pid": os.getpid(),
+            "loaded_by_pid": self._pid if self._engine is not None else None,
+            "loaded_at": self._loaded_at,
+            "load_seconds": self._load_seconds,
+            "warmup_seconds": self._warmup_seconds,
+            "uptime": time.time() - self._started_at
+        }
@@ -0,0 +1,165 @@
+"""
+Evaluates the coarse-to-fine screening of tiled inference: how many windows the coarse pass
+skips, how much time that saves and how much recall it costs compared to predicting every window.
+
+The evaluation scenes are mosaics of grid x grid samples of the TFRecord dataset. Run from the
+repository root:
+
+    python -m ml_model.screening "/data/wellpads/*.gz" --scales 2,4 --thresholds 0.05,0.1,0.2
+
+Pick the settings with an acceptable recall change and serve them with SCREEN_SCALE and
+SCREEN_THRESHOLD.
+"""
+import sys
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from ml_model.detect import predict_tiled, predict_batch, screen_windows, window_positions
+
+logger = logging.getLogger(__name__)
+
+
+def mosaics(images, masks, grid=4):
+    """
+    Assembles scenes of grid x grid samples.
+
+    Parameters:
+        images (np.ndarray): Samples of shape (N, H, W, 3) in [0, 1].
+        masks (np.ndarray): Labels of shape (N, H, W, 1).
+
+    Returns:
+        list: (scene, truth) pairs, RGB uint8 of shape (grid * H, grid * W, 3) and boolean masks.
+    """
+    per_scene = grid * grid
+    scenes = []
+    for start in range(0, len(images) - per_scene + 1, per_scene):
+        rows = [np.concatenate(list(images[start + r * grid:start + (r + 1) * grid]), axis=1) for r in range(grid)]
+        truth_rows = [np.concatenate(list(masks[start + r * grid:start + (r + 1) * grid]), axis=1) for r in range(grid)]
+        scene = (np.concatenate(rows, axis=0) * 255.0).round().astype(np.uint8)
+        scenes.append((scene, np.concatenate(truth_rows, axis=0)[..., 0] > 0.5))
+    return scenes
+
+
+def recall(pred, truth):
+    """Pixel recall and the fraction of labelled wellpads with at least one detected pixel."""
+    pixels = truth.sum()
+    pixel_recall = float(np.logical_and(pred, truth).sum() / pixels) if pixels else 1.0
+    num_labels, labels = cv2.connectedComponents(truth.astype(np.uint8), connectivity=8)
+    if num_labels <= 1:
+        return pixel_recall, 1.0
+    found = np.unique(labels[pred & truth])
+    return pixel_recall, float(len(found[found > 0]) / (num_labels - 1))
+
+
+def evaluate(scenes, scales, thresholds, threshold=0.5, overlap=32, batch_size=8, predict_fn=None):
+    """
+    Runs tiled inference on every scene without screening, then with every screening setting.
+
+    Returns:
+        list: One entry per setting with the windows predicted and skipped, the time, the pixel
+            and wellpad recall against the labels, their change from the unscreened run and
+            the agreement (dice) with the unscreened masks.
+    """
+    predict_fn = predict_fn or predict_batch
+    settings = [(0, None)] + [(scale, screen_threshold) for scale in scales for screen_threshold in thresholds]
+    totals = {setting: {'windows': 0, 'skipped': 0, 'seconds': 0.0, 'pixel_recall': [], 'wellpad_recall': [],
+                        'intersection': 0, 'total': 0}
+              for setting in settings}
+    # Warm the model up so the first timed run does not pay for tracing
+    predict_tiled(scenes[0][0], overlap=overlap, batch_size=batch_size, predict_fn=predict_fn)
+    for scene, truth in scenes:
+        baseline = None
+        positions = window_positions(scene.shape[0], scene.shape[1], overlap=overlap)
+        for scale, screen_threshold in settings:
+            total = totals[(scale, screen_threshold)]
+            start = time.perf_counter()
+            prob = predict_tiled(scene, overlap=overlap, batch_size=batch_size, predict_fn=predict_fn,
+                                 screen_scale=scale, screen_threshold=screen_threshold or 0.0)
+            total['seconds'] += time.perf_counter() - start
+            pred = prob > threshold
+            if baseline is None:
+                baseline = pred
+            total['windows'] += len(positions)
+            if scale:
+                # Counted on their own so the timing above is that of the served code path
+                keep = screen_windows(scene, positions, scale=scale, threshold=screen_threshold,
+                                      overlap=overlap, batch_size=batch_size, predict_fn=predict_fn)
+                total['skipped'] += int((~keep).sum())
+            pixel_recall, wellpad_recall = recall(pred, truth)
+            total['pixel_recall'].append(pixel_recall)
+            total['wellpad_recall'].append(wellpad_recall)
+            total['intersection'] += int(np.logical_and(pred, baseline).sum())
+            total['total'] += int(pred.sum() + baseline.sum())
+
+    reference = totals[(0, None)]
+    results = []
+    for (scale, screen_threshold), total in totals.items():
+        pixel_recall = float(np.mean(total['pixel_recall']))
+        wellpad_recall = float(np.mean(total['wellpad_recall']))
+        results.append({
+            'scale': scale,
+            'screen_threshold': screen_threshold,
+            'windows': total['windows'],
+            'skipped': total['skipped'],
+            'skipped_percent': round(100.0 * total['skipped'] / max(total['windows'], 1), 2),
+            'seconds': round(total['seconds'], 3),
+            'speedup': round(reference['seconds'] / total['seconds'], 3) if total['seconds'] else None,
+            'pixel_recall': round(pixel_recall, 4),
+            'wellpad_recall': round(wellpad_recall, 4),
+            'pixel_recall_change': round(pixel_recall - float(np.mean(reference['pixel_recall'])), 4),
+            'wellpad_recall_change': round(wellpad_recall - float(np.mean(reference['wellpad_recall'])), 4),
+            'agreement': round(2.0 * total['intersection'] / total['total'], 4) if total['total'] else 1.0
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data', help='TFRecord files (glob pattern)')
+    parser.add_argument('--samples', type=int, default=256, help='Samples assembled into scenes')
+    parser.add_argument('--grid', type=int, default=4, help='Samples per side of a scene')
+    parser.add_argument('--scales', default='2,4', help='Comma separated downsampling factors')
+    parser.add_argument('--thresholds', default='0.05,0.1,0.2', help='Comma separated screening thresholds')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Threshold of the masks')
+    parser.add_argument('--overlap', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('-o', '--output', default=None, help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    from ml_model.export import load_samples
+    images, masks = load_samples(args.data, args.samples)
+    scenes = mosaics(images, masks, args.grid)
+    if not scenes:
+        raise ValueError(f"{len(images)} samples do not fill a {args.grid}x{args.grid} scene")
+    logger.info(f"Evaluating on {len(scenes)} scenes of {scenes[0][0].shape[1]}x{scenes[0][0].shape[0]}")
+
+    results = evaluate(
+        scenes,
+        scales=[float(s) for s in args.scales.split(',') if s.strip()],
+        thresholds=[float(t) for t in args.thresholds.split(',') if t.strip()],
+        threshold=args.threshold,
+        overlap=args.overlap,
+        batch_size=args.batch_size)
+
+    print(f"{'scale':>6} {'screen':>7} {'skipped':>8} {'seconds':>8} {'speedup':>8} {'recall':>7} {'change':>7} "
+          f"{'wellpads':>8} {'change':>7} {'agree':>6}")
+    for r in results:
+        print(f"{r['scale'] or '-':>6} {r['screen_threshold'] if r['screen_threshold'] is not None else '-':>7} "
+              f"{r['skipped_percent']:7.1f}% {r['seconds']:8.2f} {r['speedup']:8.2f} {r['pixel_recall']:7.4f} "
+              f"{r['pixel_recall_change']:+7.4f} {r['wellpad_recall']:8.4f} {r['wellpad_recall_change']:+7.4f} "
+              f"{r['agreement']:6.3f}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
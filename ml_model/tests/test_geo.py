@@ -0,0 +1,94 @@
+import json
+
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+import rasterio.warp
+from rasterio.transform import from_origin
+
+from ml_model.geo import detect_raster, chunk_windows
+
+# 1 mm degree pixels from (-102, 32), so expected bounds are exact multiples of the pixel size
+ORIGIN_X, ORIGIN_Y, PIXEL = -102.0, 32.0, 0.001
+
+
+def bright_pixels(batch):
+    """Toy model: the probability is 1 where the window is bright."""
+    return (np.asarray(batch).mean(axis=-1, keepdims=True) > 0.5).astype(np.float32)
+
+
+def write_scene(path, boxes, size=300, crs='EPSG:4326', transform=None):
+    data = np.zeros((3, size, size), dtype=np.uint8)
+    for y0, y1, x0, x1 in boxes:
+        data[:, y0:y1, x0:x1] = 255
+    with rasterio.open(path, 'w', driver='GTiff', width=size, height=size, count=3, dtype='uint8', crs=crs,
+                       transform=transform or from_origin(ORIGIN_X, ORIGIN_Y, PIXEL, PIXEL)) as dst:
+        dst.write(data)
+
+
+def bounds(geometry):
+    points = [point for ring in geometry['coordinates'] for point in ring]
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def test_chunk_windows_cover_the_raster_once():
+    coverage = np.zeros((300, 250), dtype=np.int32)
+    for _, _, y, x, h, w in chunk_windows(300, 250, 128):
+        coverage[y:y + h, x:x + w] += 1
+    assert (coverage == 1).all()
+
+
+def test_wellpad_across_chunk_borders_is_one_feature(tmp_path):
+    # Crosses the chunk borders at row 128 and column 128, so it is split over four chunks
+    write_scene(tmp_path / 'scene.tif', [(100, 170, 110, 200)])
+    results = detect_raster(str(tmp_path / 'scene.tif'), str(tmp_path / 'mask.tif'),
+                            geojson_path=str(tmp_path / 'scene.geojson'), chunk_size=128,
+                            predict_fn=bright_pixels)
+
+    features = json.loads((tmp_path / 'scene.geojson').read_text())['features']
+    assert results['detections']['count'] == len(features) == 1
+    properties = features[0]['properties']
+    assert properties['bbox'] == [110, 100, 90, 70]
+    assert properties['area'] == 90 * 70
+    assert properties['centroid'] == pytest.approx([ORIGIN_X + 0.155, ORIGIN_Y - 0.135])
+    assert bounds(features[0]['geometry']) == pytest.approx(
+        (ORIGIN_X + 0.110, ORIGIN_Y - 0.170, ORIGIN_X + 0.200, ORIGIN_Y - 0.100))
+
+    with rasterio.open(tmp_path / 'mask.tif') as mask:
+        assert mask.transform == from_origin(ORIGIN_X, ORIGIN_Y, PIXEL, PIXEL)
+        assert int((mask.read(1) > 0).sum()) == 90 * 70
+
+
+def test_diagonal_contact_across_a_border_is_joined(tmp_path):
+    # Two squares touching only at a corner, the corner lying on the chunk border at column 128
+    write_scene(tmp_path / 'scene.tif', [(40, 60, 108, 128), (60, 80, 128, 148)])
+    results = detect_raster(str(tmp_path / 'scene.tif'), str(tmp_path / 'mask.tif'), chunk_size=128,
+                            predict_fn=bright_pixels)
+
+    wellpads = results['detections']['wellpads']
+    assert len(wellpads) == 1
+    assert wellpads[0]['bbox'] == [108, 40, 40, 40]
+    assert wellpads[0]['area'] == 2 * 20 * 20
+
+
+def test_projected_raster_is_written_in_its_crs_or_wgs84(tmp_path):
+    transform = from_origin(500000.0, 3500000.0, 10.0, 10.0)
+    write_scene(tmp_path / 'scene.tif', [(100, 170, 110, 200)], crs='EPSG:32614', transform=transform)
+    native = tmp_path / 'native.geojson'
+    detect_raster(str(tmp_path / 'scene.tif'), str(tmp_path / 'mask.tif'), geojson_path=str(native),
+                  chunk_size=128, wgs84=False, predict_fn=bright_pixels)
+    wgs84 = tmp_path / 'wgs84.geojson'
+    detect_raster(str(tmp_path / 'scene.tif'), str(tmp_path / 'mask.tif'), geojson_path=str(wgs84),
+                  chunk_size=128, predict_fn=bright_pixels)
+
+    collection = json.loads(native.read_text())
+    assert collection['crs']['properties']['name'] == 'EPSG:32614'
+    feature = collection['features'][0]
+    assert bounds(feature['geometry']) == pytest.approx((501100.0, 3498300.0, 502000.0, 3499000.0))
+    assert feature['properties']['area_map_units'] == pytest.approx(90 * 70 * 100.0)
+
+    (lon,), (lat,) = rasterio.warp.transform('EPSG:32614', 'EPSG:4326', [501550.0], [3498650.0])
+    assert json.loads(wgs84.read_text())['features'][0]['properties']['centroid'] == pytest.approx(
+        [lon, lat], abs=1e-6)
@@ -64,13 +64,19 @@ export default async function handler(
       contentType: file.mimetype || 'image/jpeg'
     })
 
-    console.log('Sending request to Python backend at:', PYTHON_BACKEND_URL)
+    // Forward the query string and Accept header so the backend can negotiate the response format
+    const query = req.url && req.url.includes('?') ? req.url.slice(req.url.indexOf('?')) : ''
+    const backendUrl = `${PYTHON_BACKEND_URL}${query}`
+    console.log('Sending request to Python backend at:', backendUrl)
     
     // Send to Python backend
-    const response = await fetch(PYTHON_BACKEND_URL, {
+    const response = await fetch(backendUrl, {
       method: 'POST',
       body: formData,
-      headers: formData.getHeaders()
+      headers: {
+        ...formData.getHeaders(),
+        Accept: req.headers.accept || 'application/json'
+      }
     })
 
     console.log('Python backend response status:', response.status)
@@ -92,9 +98,12 @@ export default async function handler(
       throw new Error(errorMessage)
     }
 
-    const results = await response.json()
+    // Pass the body through untouched instead of parsing and re-serializing it
+    const contentType = response.headers.get('content-type') || 'application/json'
+    const body = Buffer.from(await response.arrayBuffer())
     console.log('Successfully processed image')
-    return res.status(200).json(results)
+    res.setHeader('Content-Type', contentType)
+    return res.status(200).send(body)
 
   } catch (error) {
     console.error('Error processing image:', error)
@@ -0,0 +1,76 @@
+import type { NextApiRequest, NextApiResponse } from 'next'
+import fetch from 'node-fetch'
+
+// Background jobs of the Python backend, for scenes that take longer than a proxied request may:
+//   POST /api/ml/jobs                    -> POST /api/jobs (same upload as /api/ml/detect)
+//   GET  /api/ml/jobs/<job_id>           -> GET  /api/jobs/<job_id>
+//   GET  /api/ml/jobs/<job_id>/result    -> GET  /api/jobs/<job_id>/result
+const PYTHON_BACKEND_URL = `${process.env.NEXT_PUBLIC_API_URL}/api/jobs`
+
+export const config = {
+  api: {
+    // The upload is streamed to the backend as is
+    bodyParser: false,
+  },
+}
+
+export default async function handler(
+  req: NextApiRequest,
+  res: NextApiResponse
+) {
+  const segments = ([] as string[]).concat(req.query.path || [])
+  const isSubmit = segments.length === 0
+  const isValidPath = isSubmit || (segments.length <= 2 && (segments.length === 1 || segments[1] === 'result'))
+  if (!isValidPath) {
+    return res.status(404).json({ error: 'Not found' })
+  }
+  if (req.method !== (isSubmit ? 'POST' : 'GET')) {
+    return res.status(405).json({ error: 'Method not allowed' })
+  }
+
+  const query = req.url && req.url.includes('?') ? req.url.slice(req.url.indexOf('?')) : ''
+  const backendUrl = `${PYTHON_BACKEND_URL}${segments.map(s => `/${encodeURIComponent(s)}`).join('')}${query}`
+
+  try {
+    const headers: Record<string, string> = { Accept: req.headers.accept || 'application/json' }
+    if (isSubmit) {
+      headers['Content-Type'] = req.headers['content-type'] || 'application/octet-stream'
+      if (req.headers['content-length']) {
+        headers['Content-Length'] = req.headers['content-length']
+      }
+    }
+    const response = await fetch(backendUrl, {
+      method: req.method,
+      body: isSubmit ? req : undefined,
+      headers
+    })
+
+    // Status codes (202 while running, 429 when the queue is full, 4xx/5xx for failed jobs),
+    // polling headers and the body are passed through untouched
+    const location = response.headers.get('location')
+    if (location) {
+      res.setHeader('Location', location.replace(/^\/api\/jobs/, '/api/ml/jobs'))
+    }
+    const retryAfter = response.headers.get('retry-after')
+    if (retryAfter) {
+      res.setHeader('Retry-After', retryAfter)
+    }
+    res.setHeader('Content-Type', response.headers.get('content-type') || 'application/json')
+    const body = Buffer.from(await response.arrayBuffer())
+    return res.status(response.status).send(body)
+
+  } catch (error) {
+    console.error('Error proxying job request:', error)
+
+    if (error instanceof Error && error.message.includes('ECONNREFUSED')) {
+      return res.status(503).json({
+        error: 'Python backend is not running.',
+        details: 'Please start the Python backend service'
+      })
+    }
+
+    return res.status(500).json({
+      error: error instanceof Error ? error.message : 'Failed to reach the job API'
+    })
+  }
+}